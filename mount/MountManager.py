@@ -1,32 +1,60 @@
 import functools
 import math
 import os.path
+import shlex
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
 from threading import Lock
-from typing import Callable, List, Optional
+from typing import Callable, List, NamedTuple, Optional, Set
 
-from jproperties import Properties
 from mcdreforged.api.decorator import new_thread
 from mcdreforged.api.rtext import *
 from mcdreforged.api.types import CommandSource
 
+from . import metrics
+from .allocator import Allocator, SlotFilter
+from .archive_helper import ARCHIVE_FORMATS, ArchiveHelper, default_format
 from .config import MountConfig, SlotConfig
 from .constants import *
 from .detect_helper import DetectHelper
+from .lease import Lease
+from .manifest import Manifest, readahead
 from .MountSlot import MountSlot
-from .reset_helper import ResetHelper
-from .utils import logger, psi, rtr, debug
+from .op_queue import OpQueue, QueuedOp, parse_time
+from .pipeline import Pipeline, PipelineError, PipelineStuckError
+from .properties_helper import PatchResult, PropertiesHelper, is_secret
+from .region_helper import RegionHelper
+from .scheduler import Task, scheduler
+from .reset_helper import RESET_MODES, ResetHelper, ResetProgress
+from .slot_cache import slot_cache
+from .slot_watcher import SlotWatcher
+from .snapshot_helper import RollbackError, SnapshotHelper
+from .stage_helper import StageHelper, StageSwapError
+from .stats_index import STATS_SORT_KEYS, stats_index
+from .storage import SqliteStorage, get_storage, set_storage
+from .store_helper import StoreHelper
+from .utils import logger, psi, rtr, debug, span
 
 
 class Operation(Enum):
     REQUEST_RESET = 'request reset'
     REQUEST_MOUNT = 'request mount'
+    REQUEST_ROLLBACK = 'request rollback'
     RESET = 'reset'
     MOUNT = 'mount'
+    ROLLBACK = 'rollback'
     IDLE = 'idle'
 
 
+# max bytes of a world loaded into page cache before mount or reset
+READAHEAD_LIMIT = 2 << 30
+# seconds between checks of the operation queue
+QUEUE_TICK = 5
+# seconds between checks of the idle time of current slot
+IDLE_TICK = 60
+IDLE_ACTIONS = ['reset', 'release', 'both']
+
 _operation_lock = Lock()
 current_op = Operation.IDLE
 
@@ -41,13 +69,16 @@ def single_op(op_type: Operation):
             # allowed operation flow:
             # IDLE -> REQUEST_RESET -> RESET / IDLE
             # IDLE -> REQUEST_MOUNT -> MOUNT / IDLE
-            with _operation_lock:
-                global current_op
+            # IDLE -> REQUEST_ROLLBACK -> ROLLBACK / IDLE
+            with _operation_lock, span('single_op', op=op_type.value, current=current_op.value) as s:
                 allow = current_op is Operation.IDLE \
                     or (current_op is Operation.REQUEST_RESET and op_type is Operation.RESET) \
                     or (current_op is Operation.REQUEST_MOUNT and op_type is Operation.MOUNT) \
-                    or (current_op in [Operation.REQUEST_RESET, Operation.REQUEST_MOUNT] and op_type is Operation.IDLE)
-                debug(f"Executing operation {op_type}, current operation {current_op}, allow = {allow}")
+                    or (current_op is Operation.REQUEST_ROLLBACK and op_type is Operation.ROLLBACK) \
+                    or (current_op in [Operation.REQUEST_RESET, Operation.REQUEST_MOUNT, Operation.REQUEST_ROLLBACK]
+                        and op_type is Operation.IDLE)
+                debug("Executing operation %s, current operation %s, allow = %s", op_type, current_op, allow)
+                s.set(allow=allow)
                 if allow:
                     func(manager, src, *args, **kwargs)
                 else:
@@ -58,29 +89,96 @@ def single_op(op_type: Operation):
     return wrapper
 
 
-def need_restart(reason: RTextBase):
+class PrepareError(Exception):
+    """
+    The operation can't be prepared, nothing is changed yet
+    """
+
+
+class MountPlan(NamedTuple):
+    # patched server.properties, None for unchanged
+    properties: Optional[bytes]
+    mcdr_changes: dict
+
+
+def need_restart(reason: RTextBase, op: str, prepare: Optional[Callable] = None, on_abort: Optional[Callable] = None):
     """
-    Stop server, execute the function, and then restart server and reload plugin
+    Stop server, execute the function, and then restart server and reload plugin,
+    every phase is timed as operation op of the slot.
+    In prepared mode, prepare(manager, slot) runs during the countdown and its result is passed to the function
+    as prepared, so the server is only stopped for the commit. If it fails, on_abort(manager, slot) is called
+    and the server keeps running. If the function fails, the server is started again and the failure is broadcast
     """
     def wrapper(func: Callable):
         @functools.wraps(func)
-        def wrap(*args, **kwargs):
-            debug(f"Need restart: {reason}")
+        def wrap(manager, source: CommandSource, slot: MountSlot, *args, **kwargs):
+            debug("Need restart: %s", reason)
             global current_op
-            for t in range(10):
-                psi.broadcast(rtr('info.countdown', sec=10 - t, reason=reason))
-                time.sleep(1)
-            psi.stop()
-            psi.wait_for_start()
-            func(*args, **kwargs)
-            psi.start()
-            current_op = Operation.IDLE
+            metrics.begin(op, slot.path)
+            # whatever happens, the operation ends here, never left stuck until the plugin is reloaded
+            try:
+                preparing: Optional[Future] = None
+                if prepare is not None and manager.get_config('prepared_restart'):
+                    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mount-prepare')
+                    preparing = pool.submit(metrics.timed('prepare')(prepare), manager, slot)
+                    pool.shutdown(wait=False)
+                with metrics.phase('countdown'):
+                    if manager.get_config('skip_empty_countdown') and manager.is_empty():
+                        debug("No player online, skipping countdown")
+                    else:
+                        for t in range(10):
+                            psi.broadcast(rtr('info.countdown', sec=10 - t, reason=reason))
+                            time.sleep(1)
+                if preparing is not None:
+                    try:
+                        with metrics.phase('prepare_wait'):
+                            kwargs['prepared'] = preparing.result()
+                    except Exception as e:
+                        if not isinstance(e, PrepareError):
+                            logger().exception(f'Failed to prepare {op} of {slot.path}')
+                        psi.broadcast(RText(rtr('error.prepare.failed', reason=e), color=RColor.red))
+                        metrics.discard()
+                        if on_abort is not None:
+                            on_abort(manager, slot)
+                        return
+                with metrics.phase('stop'):
+                    psi.stop()
+                    psi.wait_for_start()
+                try:
+                    func(manager, source, slot, *args, **kwargs)
+                except PipelineStuckError as e:
+                    # a step is still changing the slot, the server must not start on it
+                    logger().error(f'{op} of {slot.path} aborted, steps {e.stuck} still running, server left stopped')
+                    psi.broadcast(RText(rtr('error.mount_stuck', steps=', '.join(e.stuck), path=slot.path),
+                                        color=RColor.red))
+                    metrics.discard()
+                    return
+                except Exception as e:
+                    logger().exception(f'Failed to {op} {slot.path}')
+                    psi.broadcast(RText(rtr('error.operation_failed', op=op, reason=e, path=slot.path),
+                                        color=RColor.red))
+                    metrics.discard()
+                with metrics.phase('start'):
+                    psi.start()
+                metrics.wait_ready()
+            finally:
+                current_op = Operation.IDLE
             psi.refresh_changed_plugins()
         return wrap
 
     return wrapper
 
 
+def broadcast_reset_progress(progress: ResetProgress):
+    """
+    Report reset progress the same way as the restart countdown
+    """
+    psi.broadcast(rtr(f'info.reset_progress.{progress.phase}',
+                      done=progress.files_done, total=progress.files_total,
+                      done_mb=round(progress.bytes_done / 1048576, 1),
+                      total_mb=round(progress.bytes_total / 1048576, 1)))
+
+
 class MountManager:
     def __init__(self, config: MountConfig):
         """
@@ -90,7 +188,20 @@ class MountManager:
         debug("Initializing MountManager...")
         self.configurable_things = None
         self._config = config
-        self.current_slot: Optional[MountSlot] = MountSlot(self._config.current_server)
+        self._available_set = set(config.available_servers)
+        self._detect_lock = Lock()
+        self._watcher: Optional[SlotWatcher] = None
+        self._heartbeat_task: Optional[Task] = None
+        self.queue = OpQueue(os.path.join(psi.get_data_folder(), QUEUE_FILE))
+        self._queue_task: Optional[Task] = None
+        self._queue_lock = Lock()
+        self._idle_task: Optional[Task] = None
+        # players online, None if unknown, e.g. reloaded while the server is running
+        self._online: Optional[Set[str]] = None
+        set_storage(config.registry, self.get_registry_path())
+        slot_cache.invalidate()
+        self.current_slot: Optional[MountSlot] = MountSlot(self._config.current_server,
+                                                           self._config.stats_flush_interval, self._config.lease_ttl)
         try:
             self.current_slot.lock(self._config.mount_name)
         except ResourceWarning:
@@ -99,29 +210,234 @@ class MountManager:
             psi.stop()
             return
         self.next_slot: Optional[MountSlot] = None
+        self.next_snapshot: Optional[str] = None
+
+
+    def sync_slots(self, reply: Optional[Callable[[RTextBase], None]] = None) -> List[str]:
+        """
+        Detect slots from servers path, update available servers in place
+        :param reply: where to report the detected slots, default to the console
+        :return: the new slots
+        """
+        reply = reply if reply is not None else logger().info
+        with self._detect_lock:
+            new_slots, removal_slots = DetectHelper.detect_slots(
+                self._config.servers_path, self._config.available_servers,
+                cache_file=os.path.join(psi.get_data_folder(), DETECT_CACHE))
+
+            self._config.available_servers.extend(new_slots)
+            for slot in new_slots:
+                if not get_storage().exists(slot):
+                    DetectHelper.init_conf(slot)
+                    reply(rtr('detect.init_conf', path=slot))
+
+            for slot in removal_slots:
+                debug("removing %s from available servers...", slot)
+                self._config.available_servers.remove(slot)
+
+            if len(new_slots) > 0 or len(removal_slots) > 0:
+                self._config.save()
+                self._available_set = set(self._config.available_servers)
+        return new_slots
+
+    def on_slots_changed(self):
+        """
+        Called by the slot watcher, update the slots without reloading the plugin
+        """
+        new_slots = self.sync_slots()
+        for slot in new_slots:
+            logger().info(rtr('detect.detected', path=slot))
+
+    def start_watcher(self):
+        if not self._config.watch_servers or self._watcher is not None:
+            return
+        self._watcher = SlotWatcher(self._config.servers_path, self._config.watch_interval, self.on_slots_changed)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def start_heartbeat(self):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = scheduler.schedule(max(self._config.lease_ttl / 3, 1), self.heartbeat_leases,
+                                                      'lease heartbeat')
+
+    def heartbeat_leases(self):
+        for slot in [self.current_slot, self.next_slot]:
+            if slot is None:
+                continue
+            try:
+                alive = slot.lease.heartbeat(self._config.mount_name)
+            except (OSError, TimeoutError) as e:
+                logger().error(f'Failed to renew lease of {slot.path}: {e}')
+                continue
+            if not alive:
+                logger().warning(f'Lease of {slot.path} is lost, it may be used by another instance!')
+
+    def seed_players(self):
+        """
+        The players online are unknown after a reload while the server is running, ask the server by rcon if possible
+        """
+        if not psi.is_server_running() or not psi.is_server_startup():
+            # nobody can join before the server is started
+            self._online = set()
+        else:
+            self._online = None
+            if psi.is_rcon_running():
+                # There are 1 of a max of 20 players online: Steve
+                result = psi.rcon_query('list')
+                if result is not None and ':' in result:
+                    self._online = set(i.strip() for i in result.split(':', 1)[1].split(',') if i.strip() != '')
+        debug("Players online after load: %s", self._online)
+        if self.current_slot is not None:
+            self.current_slot.seed_players(self._online)
+
+    def track_player(self, player: str, online: bool):
+        if self._online is None:
+            return
+        if online:
+            self._online.add(player)
+        else:
+            self._online.discard(player)
+            if len(self._online) == 0:
+                scheduler.call_later(0, self.run_queue, 'operation queue')
+
+    def reset_players(self):
+        """
+        Called when the server starts or stops, nobody is online then
+        """
+        self._online = set()
+        if self.current_slot is not None:
+            self.current_slot.seed_players(self._online)
+
+    def is_empty(self) -> bool:
+        return self._online is not None and len(self._online) == 0
+
+    def start_queue(self):
+        if self._queue_task is None:
+            self._queue_task = scheduler.schedule(QUEUE_TICK, self.run_queue, 'operation queue')
+
+    def run_queue(self):
+        """
+        Run the head of the queue if it is due, the server is started and no operation is running
+        """
+        if current_op is not Operation.IDLE or not psi.is_server_startup():
+            return
+        if not self._queue_lock.acquire(blocking=False):
+            return
+        try:
+            queued = self.queue.pop_due(self.is_empty())
+            if queued is None:
+                return
+            logger().info(rtr('queue.running', id=queued.id, op=queued.op, path=queued.path))
+            src = psi.get_plugin_command_source()
+            if queued.op == 'mount':
+                self.request_mount(src, queued.path)
+                expected = Operation.REQUEST_MOUNT
+            else:
+                self.request_reset(src)
+                expected = Operation.REQUEST_RESET
+            if current_op is expected:
+                self.confirm_operation(src)
+            else:
+                logger().warning(rtr('queue.rejected', id=queued.id, op=queued.op, path=queued.path))
+        finally:
+            self._queue_lock.release()
+
+    def start_idle_check(self):
+        if self._idle_task is None:
+            self._idle_task = scheduler.schedule(IDLE_TICK, self.check_idle, 'idle check')
+
+    def check_idle(self):
+        """
+        Queue the idle action of current slot once nobody is online for idle_minutes, the queued operations
+        still wait for an empty server, so a player joining in the meantime only delays them
+        """
+        slot = self.current_slot
+        if slot is None or slot.idle_minutes <= 0 or current_op is not Operation.IDLE \
+                or not self.is_empty() or slot.idle_seconds() < slot.idle_minutes * 60:
+            return
+        if slot.idle_action not in IDLE_ACTIONS:
+            logger().error(rtr('error.idle.invalid_action', path=slot.path, action=slot.idle_action))
+            return
+        # a queued reset or mount of another slot reclaims this one already, it may be waiting behind
+        # a blocked head, don't pile up more of them every tick
+        if any(i.op == 'reset' or i.path != slot.path for i in self.queue.list()):
+            return
+        idle_server = self._config.idle_server
+        # an unused slot needs no reset, it was reset or is fresh since mounted
+        reset = slot.idle_action in ['reset', 'both'] and slot.used and slot.reset_path not in ['', None, '.']
+        release = slot.idle_action in ['release', 'both'] and idle_server not in ['', None] \
+            and idle_server != slot.path and self.is_available(idle_server)
+        if slot.idle_action in ['release', 'both'] and not release and idle_server != slot.path:
+            logger().warning(rtr('error.idle.no_server', path=slot.path))
+        slot.mark_active()
+        if not reset and not release:
+            return
+        logger().info(rtr('idle.reclaim', path=slot.path, minutes=slot.idle_minutes))
+        if reset:
+            self.queue.add('reset', '', 'empty')
+        if release:
+            self.queue.add('mount', idle_server, 'empty')
+        scheduler.call_later(0, self.run_queue, 'operation queue')
+
+    def queue_operation(self, src: CommandSource, op: str, path: str = '', trigger: str = 'next',
+                        time_text: Optional[str] = None):
+        at = 0.0
+        if trigger == 'at':
+            at = parse_time(time_text)
+            if at is None:
+                src.reply(rtr('error.queue.invalid_time', time=time_text))
+                return
+        queued = self.queue.add(op, path, trigger, at)
+        src.reply(RTextList(rtr('queue.added'), self.get_queue_entry(queued)))
+        scheduler.call_later(0, self.run_queue, 'operation queue')
+
+    def remove_queued(self, src: CommandSource, op_id: Optional[int] = None):
+        src.reply(rtr('queue.removed', num=self.queue.remove(op_id)))
+
+    def list_queue(self, src: CommandSource):
+        ops = self.queue.list()
+        src.reply(RText(rtr('queue.title')))
+        if len(ops) == 0:
+            src.reply(rtr('list.empty'))
+        for queued in ops:
+            src.reply(RTextList(
+                RText('[x] ', color=RColor.red).h(rtr('queue.remove_hover'))
+                .c(RAction.suggest_command, f'{COMMAND_PREFIX} --queue remove {queued.id}'),
+                self.get_queue_entry(queued)
+            ))
 
+    @staticmethod
+    def get_queue_entry(queued: QueuedOp) -> RTextBase:
+        """
+        #id op path, trigger
+        """
+        if queued.trigger == 'at':
+            trigger = rtr('queue.trigger.at', time=time.strftime('%Y-%m-%d %H:%M', time.localtime(queued.at)))
+        else:
+            trigger = rtr(f'queue.trigger.{queued.trigger}')
+        return RTextList(
+            RText(f'#{queued.id} ', color=RColor.gray),
+            RText(rtr(f'queue.op.{queued.op}', path=queued.path), color=RColor.yellow),
+            ', ',
+            RText(trigger, color=RColor.aqua)
+        )
 
     def reload(self, src: CommandSource):
         debug("received reload request, reloading...")
         self._config = MountConfig.load()
-        
-        new_slots, removal_slots = DetectHelper.detect_slots(self._config.servers_path, self._config.available_servers)
-        
-        self._config.available_servers.extend(new_slots)
-        for slot in new_slots:
-            if not os.path.isfile(os.path.join(slot, MOUNTABLE_CONFIG)):
-                DetectHelper.init_conf(slot)
-                src.reply(rtr('detect.init_conf', path=slot))
-
-        for slot in removal_slots:
-            debug(f"removing {slot} from available servers...")
-            self._config.available_servers.remove(slot)
+        slot_cache.invalidate()
 
+        new_slots = self.sync_slots(src.reply)
         if len(new_slots) > 0:
             src.reply(rtr('detect.summary', num=len(new_slots)))
         else:
             src.reply(rtr('detect.summary_empty'))
         self._config.save()
+        self._available_set = set(self._config.available_servers)
         debug("reload path done, try to reload self plugin...")
         psi.reload_plugin(psi.get_self_metadata().id)
 
@@ -134,28 +450,30 @@ class MountManager:
         """
         return self._config.available_servers
 
-    @new_thread("mount-patch_properties")
-    def patch_properties(self, slot: MountSlot):
+    def is_available(self, path: str) -> bool:
+        """
+        check if the path is an available server, without scanning the list
+        """
+        return path in self._available_set
+
+    @metrics.timed('prepare_properties')
+    def prepare_properties(self, slot: MountSlot) -> Optional[bytes]:
+        """
+        :return: content of server.properties patched by the overwrite file, None if nothing to patch
+        """
         if self._config.overwrite_path in ['', '.', None]:
-            return
-        logger().info("Patching properties file...")
-        slot.load_properties()
-        patches = Properties()
-        try:
-            with open(self._config.overwrite_path, mode="rb") as f:
-                patches.load(f, 'utf-8')
-        except FileNotFoundError:
+            return None
+        patches = PropertiesHelper.load_overwrite(self._config.overwrite_path)
+        if patches is None:
             logger().error('File Not Found, ignore overwriting...')
-            return
-        for k, v in patches.items():
-            slot.properties[k] = v
-        slot.save_properties()
+            return None
+        content, diff = PropertiesHelper.patch(slot.path, patches)
+        debug("Patched properties of %s: %s", slot.path, list(diff))
+        return content
 
-    @new_thread("mount-patch_mcdr_config")
-    def patch_mcdr_config(self, slot: MountSlot):
-        # MCDR v2.7 provided api to modify config
-        logger().info("Patching mcdr config...")
-        current_plg_dirs = psi.get_mcdr_config()['plugin_directories']
+    @metrics.timed('prepare_mcdr_config')
+    def prepare_mcdr_config(self, slot: MountSlot) -> dict:
+        current_plg_dirs = list(psi.get_mcdr_config()['plugin_directories'])
         prev_added_plg_dir = self.current_slot.plg_dir
         if prev_added_plg_dir not in ['', None, '.']:
             try:
@@ -163,17 +481,92 @@ class MountManager:
             except ValueError:
                 pass
         if slot.plg_dir not in ['', None, '.']:
-            try:
-                current_plg_dirs.append(slot.plg_dir)
-            except ValueError:
-                pass
+            current_plg_dirs.append(slot.plg_dir)
         changes = {
             'working_directory': slot.path,
             'start_command': slot._config.start_command,
             'handler': slot._config.handler,
             'plugin_directories': current_plg_dirs
         }
-        debug(f"mcdr config changes is: {changes}")
+        debug("mcdr config changes is: %s", changes)
+        return changes
+
+    @staticmethod
+    def check_start_command(slot: MountSlot):
+        """
+        Make sure the script and the jar used by the start command exist
+        """
+        try:
+            args = shlex.split(slot._config.start_command, posix=os.name != 'nt')
+        except ValueError as e:
+            raise PrepareError(rtr('error.prepare.invalid_command', reason=e))
+        files = []
+        if len(args) > 0 and args[0][:2] in ['./', '.\\']:
+            files.append(args[0])
+        if '-jar' in args[:-1]:
+            files.append(args[args.index('-jar') + 1])
+        for i in files:
+            if not os.path.isfile(os.path.join(slot.path, i)):
+                raise PrepareError(rtr('error.prepare.missing_file', file=i, path=slot.path))
+
+    def prepare_mount(self, slot: MountSlot) -> MountPlan:
+        """
+        Check the slot and compute everything needed by the mount, while the server is still running
+        """
+        self.check_start_command(slot)
+        plan = MountPlan(self.prepare_properties(slot), self.prepare_mcdr_config(slot))
+        with metrics.phase('readahead'):
+            readahead(slot.path, WORLDS, READAHEAD_LIMIT)
+        return plan
+
+    def check_reset_path(self, slot: MountSlot):
+        """
+        Make sure the reset path can be applied before anything is deleted, an archive is read through
+        :raise PrepareError: if it can't
+        """
+        template = os.path.join(slot.path, slot._config.reset_path)
+        if ArchiveHelper.is_archive(template):
+            with metrics.phase('archive_check'):
+                try:
+                    ArchiveHelper.check(template, slot._config.reset_type)
+                except ValueError as e:
+                    raise PrepareError(rtr('error.reset.invalid_archive', reason=e))
+        elif not os.path.isdir(template):
+            raise PrepareError(rtr('error.reset.invalid_path'))
+
+    def prepare_reset(self, slot: MountSlot) -> bool:
+        """
+        Check the reset path, refresh its manifest and load it into page cache, while the server is still running
+        :return: True, the reset path is checked
+        """
+        self.check_reset_path(slot)
+        template = os.path.join(slot.path, slot._config.reset_path)
+        if ArchiveHelper.is_archive(template):
+            return True
+        if slot._config.incremental_reset or slot._config.staged_worlds > 0:
+            with metrics.phase('manifest'):
+                manifest = Manifest.load(template)
+                if manifest.update(WORLDS):
+                    manifest.save()
+        with metrics.phase('readahead'):
+            readahead(template, WORLDS, READAHEAD_LIMIT)
+        return True
+
+    def cancel_mount(self, slot: MountSlot):
+        slot.release(self._config.mount_name)
+        self.next_slot = None
+
+    @metrics.timed('patch_properties')
+    def patch_properties(self, slot: MountSlot, content: Optional[bytes]):
+        if content is None:
+            return
+        logger().info("Patching properties file...")
+        PropertiesHelper.write(slot.path, content)
+
+    @metrics.timed('patch_mcdr_config')
+    def patch_mcdr_config(self, changes: dict):
+        # MCDR v2.7 provided api to modify config
+        logger().info("Patching mcdr config...")
         psi.modify_mcdr_config(changes=changes)
 
     def request_operation(self, mode: str, source: CommandSource, path: Optional[str] = None, with_confirm=False):
@@ -188,7 +581,7 @@ class MountManager:
             source.reply(rtr('error.is_current_mount'))
             return
 
-        if path not in self._config.available_servers:
+        if not self.is_available(path):
             source.reply(rtr('error.unknown_mount_path'))
             return
 
@@ -196,15 +589,12 @@ class MountManager:
             source.reply(rtr('error.invalid_mount_path'))
             return
 
-        mountable_conf_path = os.path.join(path, MOUNTABLE_CONFIG)
-        if not os.path.isfile(mountable_conf_path):
-            psi.save_config_simple(config=SlotConfig(),
-                                   file_name=mountable_conf_path,
-                                   in_data_folder=False)
+        if not get_storage().exists(path):
+            get_storage().save(path, SlotConfig())
             source.reply(rtr('error.init_mountable_config'))
             return
 
-        next_slot = MountSlot(path)
+        next_slot = MountSlot(path, self._config.stats_flush_interval, self._config.lease_ttl)
         if not next_slot.checked:
             source.reply(rtr('error.unchecked_path'))
             return
@@ -214,12 +604,45 @@ class MountManager:
             self.next_slot = next_slot
         except ResourceWarning:
             source.reply(rtr("error.occupied"))
-            self.next_slot.release(self._config.mount_name)
-            self.next_slot = None
             return
 
         debug("Mount request accepted, waiting for confirmation...")
         current_op = Operation.REQUEST_MOUNT
+        self.reply_mount_request(source)
+
+    @single_op(Operation.REQUEST_MOUNT)
+    def request_mount_any(self, source: CommandSource, filter_text: str = ''):
+        """
+        Mount the least recently mounted free slot matching the filter, a slot taken by another instance
+        in the meantime is skipped for the next one
+        """
+        global current_op
+        debug("Received mount request for any slot matching [%s], allocating...", filter_text)
+        claimed: List[MountSlot] = []
+
+        def claim(path: str) -> bool:
+            slot = MountSlot(path, self._config.stats_flush_interval, self._config.lease_ttl)
+            # the config may be changed since the candidates are listed
+            if not slot.checked:
+                return False
+            try:
+                slot.lock(self._config.mount_name)
+            except ResourceWarning:
+                return False
+            claimed.append(slot)
+            return True
+
+        path = Allocator(self._config.lease_ttl).allocate(self._config.available_servers, SlotFilter(filter_text),
+                                                          claim, exclude=[self.current_slot.path])
+        if path is None:
+            source.reply(rtr('error.no_free_slot', filter=filter_text))
+            return
+        debug("Allocated slot %s, waiting for confirmation...", path)
+        self.next_slot = claimed[0]
+        current_op = Operation.REQUEST_MOUNT
+        self.reply_mount_request(source)
+
+    def reply_mount_request(self, source: CommandSource):
         text = RTextList(
             RText(rtr("info.mount_request", server_path=self.next_slot.path), color=RColor.yellow),
             RText(rtr('info.confirm'), color=RColor.green)
@@ -234,14 +657,17 @@ class MountManager:
         debug("Received reset request, evaluating...")
         global current_op
         # check for operation here
+        reset_path = os.path.join(self.current_slot.path, self.current_slot.reset_path)
         if self.current_slot.reset_path in ['', None, '.'] \
-                or not os.path.isdir(
-                os.path.join(self.current_slot.path, self.current_slot.reset_path)):
+                or not (os.path.isdir(reset_path) or ArchiveHelper.is_archive(reset_path)):
             source.reply(rtr('error.reset.invalid_path'))
             return
         if self.current_slot.reset_type not in ['full', 'region']:
             source.reply(rtr('error.reset.invalid_type'))
             return
+        if self.current_slot.reset_mode not in RESET_MODES:
+            source.reply(rtr('error.reset.invalid_mode'))
+            return
         debug("Reset request accepted, waiting for confirmation...")
         current_op = Operation.REQUEST_RESET
         text = RTextList(
@@ -253,10 +679,40 @@ class MountManager:
         )
         source.reply(text)
 
+    @single_op(Operation.REQUEST_ROLLBACK)
+    def request_rollback(self, source: CommandSource, snapshot_id: Optional[str] = None):
+        debug("Received rollback request for snapshot %s, evaluating...", snapshot_id)
+        global current_op
+        snapshots = SnapshotHelper.get_snapshots(self.current_slot.path)
+        if snapshot_id is None:
+            source.reply(rtr('snapshot.title'))
+            for i in snapshots:
+                source.reply(RText(f'- {i}').h(rtr('snapshot.hover'))
+                             .c(RAction.suggest_command, f'{COMMAND_PREFIX} --rollback {i}'))
+            if len(snapshots) == 0:
+                source.reply(rtr('list.empty'))
+            return
+        if snapshot_id not in snapshots:
+            source.reply(rtr('error.unknown_snapshot', snapshot=snapshot_id))
+            return
+        debug("Rollback request accepted, waiting for confirmation...")
+        current_op = Operation.REQUEST_ROLLBACK
+        self.next_snapshot = snapshot_id
+        text = RTextList(
+            RText(rtr("info.rollback_request", snapshot=snapshot_id), color=RColor.yellow),
+            RText(rtr('info.confirm'), color=RColor.green)
+                .c(RAction.suggest_command, f'{COMMAND_PREFIX} --confirm'),
+            ' ',
+            RText(rtr('info.abort'), color=RColor.red).c(RAction.suggest_command, f'{COMMAND_PREFIX} --abort')
+        )
+        source.reply(text)
+
     def confirm_operation(self, source: CommandSource):
         debug("Received confirm request, evaluating...")
         if current_op is Operation.REQUEST_RESET:
             self._do_reset(source, self.current_slot)
+        elif current_op is Operation.REQUEST_ROLLBACK:
+            self._do_rollback(source, self.current_slot)
         elif current_op is Operation.REQUEST_MOUNT:
             if not isinstance(self.next_slot, MountSlot):
                 source.reply(rtr('error.nothing_to_confirm'))
@@ -265,43 +721,328 @@ class MountManager:
 
     @new_thread('mount-resetting')
     @single_op(Operation.RESET)
-    @need_restart(reason=rtr('info.countdown_reason.reset'))
-    def _do_reset(self, source: CommandSource, slot: MountSlot):
-        debug(f"Resetting current slot {slot.path}...")
+    @need_restart(reason=rtr('info.countdown_reason.reset'), op='reset', prepare=prepare_reset)
+    def _do_reset(self, source: CommandSource, slot: MountSlot, prepared=None):
+        debug("Resetting current slot %s...", slot.path)
         global current_op
         current_op = Operation.RESET
-        ResetHelper.reset(slot.path, slot._config.reset_path, slot._config.reset_type)
+        if prepared is None:
+            try:
+                self.check_reset_path(slot)
+            except PrepareError as e:
+                psi.broadcast(RText(rtr('error.prepare.failed', reason=e), color=RColor.red))
+                return
+        diff = None
+        if slot._config.snapshot_count > 0:
+            with metrics.phase('snapshot'):
+                if self.is_partial_snapshot(slot):
+                    # the reset goes on with the same diff, the files moved aside need no delete
+                    diff = ResetHelper.diff(slot.path, slot._config.reset_path, slot._config.reset_type,
+                                            self._config.reset_workers)
+                    SnapshotHelper.take_partial(slot.path, slot._config.reset_path, diff)
+                    diff = diff._replace(deleted_dirs=[], deleted_files=[])
+                else:
+                    SnapshotHelper.take(slot.path, slot._config.reset_type)
+        if slot._config.staged_worlds > 0:
+            with metrics.phase('stage_swap'):
+                try:
+                    if StageHelper.swap(slot.path, slot._config.reset_path, slot._config.reset_type):
+                        return
+                except StageSwapError as e:
+                    # the worlds are half swapped, resetting now would lose what is left in trash
+                    psi.broadcast(RText(rtr('error.reset.swap_failed', trash=e.trash, reason=e.cause),
+                                        color=RColor.red))
+                    return
+        with metrics.phase('reset_io'):
+            ResetHelper.reset(slot.path, slot._config.reset_path, slot._config.reset_type, slot._config.reset_mode,
+                              incremental=slot._config.incremental_reset,
+                              workers=self._config.reset_workers, executor=self._config.reset_executor,
+                              progress=broadcast_reset_progress, diff=diff)
+
+    @staticmethod
+    def is_partial_snapshot(slot: MountSlot) -> bool:
+        """
+        Before an incremental reset from a dir, snapshot only the files it changes, moving the whole worlds
+        aside would turn it into a full copy. A staged swap moves the whole worlds anyway
+        """
+        return slot._config.incremental_reset and slot._config.staged_worlds <= 0 \
+            and os.path.isdir(os.path.join(slot.path, slot._config.reset_path))
+
+    @new_thread('mount-rollback')
+    @single_op(Operation.ROLLBACK)
+    @need_restart(reason=rtr('info.countdown_reason.rollback'), op='rollback')
+    def _do_rollback(self, source: CommandSource, slot: MountSlot):
+        debug("Rolling back slot %s to snapshot %s...", slot.path, self.next_snapshot)
+        global current_op
+        current_op = Operation.ROLLBACK
+        snapshot_id, self.next_snapshot = self.next_snapshot, None
+        try:
+            with metrics.phase('rollback_io'):
+                SnapshotHelper.rollback(slot.path, snapshot_id)
+        except RollbackError as e:
+            psi.broadcast(RText(rtr('error.rollback_failed', snapshot=e.snapshot_id, replaced=e.replaced,
+                                    reason=e.cause), color=RColor.red))
+        except ValueError as e:
+            psi.broadcast(RText(rtr('error.rollback_invalid', reason=e), color=RColor.red))
+        except OSError as e:
+            logger().error(f'Failed to rollback to snapshot {snapshot_id}: {e}')
+
+    @new_thread('mount-maintain')
+    def maintain_worlds(self):
+        """
+        Clean up swapped out worlds, evict old snapshots, then refill the staged worlds of current slot
+        """
+        slot = self.current_slot
+        if slot.snapshot_count > 0 or len(SnapshotHelper.get_snapshots(slot.path)) > 0:
+            SnapshotHelper.evict(slot.path, slot.snapshot_count, slot.snapshot_max_age_hours, slot.snapshot_budget_mb)
+        if slot.reset_path in ['', None, '.']:
+            StageHelper.cleanup(slot.path)
+            return
+        template = os.path.join(slot.path, slot.reset_path)
+        if self._config.store_path not in ['', None, '.'] and os.path.isdir(template):
+            try:
+                StoreHelper.import_template(self._config.store_path, template)
+            except OSError as e:
+                logger().error(f'Failed to import {template} into store: {e}')
+        StageHelper.cleanup(slot.path, slot.reset_path, slot.reset_type)
+        if slot.staged_worlds > 0:
+            StageHelper.stage(slot.path, slot.reset_path, slot.reset_type, slot.reset_mode,
+                              count=slot.staged_worlds, budget_mb=slot.stage_budget_mb,
+                              workers=self._config.reset_workers)
+
+    @new_thread('mount-pack')
+    def pack_reset_path(self, src: CommandSource, path: str, fmt: Optional[str] = None):
+        debug("Packing reset path of %s as %s", path, fmt)
+        slot = MountSlot(path)
+        template = os.path.join(path, slot.reset_path)
+        if slot.reset_path in ['', None, '.'] or not os.path.isdir(template):
+            src.reply(rtr('error.reset.invalid_path'))
+            return
+        fmt = default_format() if fmt is None else fmt
+        if fmt not in ARCHIVE_FORMATS.values():
+            src.reply(rtr('error.pack.invalid_format', formats=', '.join(sorted(set(ARCHIVE_FORMATS.values())))))
+            return
+        archive = f'{os.path.normpath(template)}.{fmt}'
+        src.reply(rtr('info.pack.start', archive=archive))
+        try:
+            size = ArchiveHelper.pack(template, archive)
+        except (OSError, RuntimeError) as e:
+            src.reply(rtr('error.pack.failed', reason=e))
+            return
+        rel_path = os.path.relpath(archive, path)
+        src.reply(RText(rtr('info.pack.done', archive=archive, size_mb=round(size / 1048576, 1)), color=RColor.green)
+                  .h(rtr('info.pack.hover'))
+                  .c(RAction.suggest_command, f'{COMMAND_PREFIX} --config {path} set reset_path {rel_path}'))
+
+    @new_thread('mount-compact')
+    def compact_reset_path(self, src: CommandSource, path: str):
+        debug("Compacting region files in reset path of %s", path)
+        slot = MountSlot(path)
+        template = os.path.join(path, slot.reset_path)
+        if slot.reset_path in ['', None, '.'] or not os.path.isdir(template):
+            src.reply(rtr('error.reset.invalid_path'))
+            return
+        src.reply(rtr('info.compact.start', path=template))
+        compacted, saved, failed = RegionHelper.compact(template)
+        src.reply(rtr('info.compact.done', num=compacted, saved_mb=round(saved / 1048576, 1)))
+        if len(failed) > 0:
+            src.reply(RText(rtr('error.compact_failed', num=len(failed)), color=RColor.red).h('\n'.join(failed)))
+
+    @new_thread('mount-patch')
+    def patch_all_properties(self, src: CommandSource, dry_run: bool = False):
+        """
+        Patch server.properties of every available slot by the overwrite file in parallel, unchanged ones are not written
+        """
+        overwrite_path = self._config.overwrite_path
+        patches = None if overwrite_path in ['', '.', None] else PropertiesHelper.load_overwrite(overwrite_path)
+        if patches is None:
+            src.reply(rtr('error.patch.no_overwrite', path=overwrite_path))
+            return
+        debug("Patching properties of all slots by %s, dry run: %s", overwrite_path, dry_run)
+        results = PropertiesHelper.patch_all(self._config.available_servers, patches, dry_run)
+        for result in results:
+            if result.error is not None:
+                src.reply(RText(rtr('error.patch.failed', path=result.path, reason=result.error), color=RColor.red))
+            elif len(result.diff) > 0:
+                src.reply(self.get_patch_entry(result))
+        changed = sum(1 for i in results if len(i.diff) > 0)
+        failed = sum(1 for i in results if i.error is not None)
+        src.reply(rtr(f'patch.{"preview" if dry_run else "done"}', changed=changed,
+                      unchanged=len(results) - changed - failed, failed=failed))
+
+    @staticmethod
+    def get_patch_entry(result: PatchResult) -> RTextBase:
+        """
+        path: changed keys, the values are shown on hover, secrets masked
+        """
+        def value(key: str, v: Optional[str]) -> str:
+            if v is None:
+                return rtr('patch.missing').to_plain_text()
+            return '***' if is_secret(key) else v
+
+        hover = '\n'.join(f'{k}: {value(k, old)} -> {value(k, new)}' for k, (old, new) in result.diff.items())
+        return RTextList(
+            RText(result.path, color=RColor.yellow),
+            ': ',
+            RText(', '.join(result.diff), color=RColor.aqua).h(hover)
+        )
+
+    @new_thread('mount-store')
+    def store_import(self, src: CommandSource, path: Optional[str] = None):
+        store = self._config.store_path
+        if store in ['', None, '.']:
+            src.reply(rtr('error.store_disabled'))
+            return
+        imported, saved, skipped = 0, 0, 0
+        for server in self._config.available_servers if path is None else [path]:
+            slot = MountSlot(server)
+            template = os.path.join(server, slot.reset_path)
+            if slot.reset_path in ['', None, '.'] or not os.path.isdir(template):
+                skipped += 1
+                continue
+            try:
+                files, size = StoreHelper.import_template(store, template)
+            except OSError as e:
+                logger().error(f'Failed to import {template} into store: {e}')
+                src.reply(rtr('error.store_import_failed', path=template, reason=e))
+                continue
+            imported += files
+            saved += size
+        src.reply(rtr('info.store.imported', num=imported, saved_mb=round(saved / 1048576, 1), skipped=skipped))
+
+    @new_thread('mount-store')
+    def store_gc(self, src: CommandSource):
+        store = self._config.store_path
+        if store in ['', None, '.']:
+            src.reply(rtr('error.store_disabled'))
+            return
+        removed, freed = StoreHelper.gc(store)
+        src.reply(rtr('info.store.gc', num=removed, freed_mb=round(freed / 1048576, 1)))
+
+    def get_registry_path(self) -> str:
+        """
+        The registry is only shared by an explicit registry_path, the servers path may be a network filesystem
+        where the locking of sqlite is not reliable
+        """
+        if self._config.registry_path not in ['', None]:
+            return self._config.registry_path
+        return os.path.join(psi.get_data_folder(), REGISTRY_FILE)
+
+    def show_registry(self, src: CommandSource):
+        storage = get_storage()
+        servers = self._config.available_servers
+        src.reply(rtr('registry.status', backend=storage.name, total=len(servers),
+                      checked=len(storage.find(servers, checked=True)),
+                      free=len(storage.find(servers, checked=True, occupied_by=''))))
+
+    @new_thread('mount-registry')
+    def registry_import(self, src: CommandSource):
+        storage = get_storage()
+        if not isinstance(storage, SqliteStorage):
+            src.reply(rtr('error.registry_not_sqlite'))
+            return
+        num = storage.import_json(self._config.available_servers)
+        slot_cache.invalidate()
+        stats_index.refresh(self._config.available_servers)
+        src.reply(rtr('registry.imported', num=num, path=storage.db_file))
+
+    @new_thread('mount-registry')
+    def registry_export(self, src: CommandSource):
+        storage = get_storage()
+        if not isinstance(storage, SqliteStorage):
+            src.reply(rtr('error.registry_not_sqlite'))
+            return
+        num = storage.export_json(self._config.available_servers)
+        src.reply(rtr('registry.exported', num=num, path=storage.db_file))
 
     @new_thread("mount-mounting")
     @single_op(Operation.MOUNT)
-    @need_restart(reason=rtr('info.countdown_reason.mount'))
-    def _do_mount(self, source: CommandSource, slot: MountSlot):
-        debug(f"Mounting slot {slot.path}...")
+    @need_restart(reason=rtr('info.countdown_reason.mount'), op='mount', prepare=prepare_mount, on_abort=cancel_mount)
+    def _do_mount(self, source: CommandSource, slot: MountSlot, prepared: Optional[MountPlan] = None):
+        debug("Mounting slot %s...", slot.path)
         global current_op
         # do the mount
         current_op = Operation.MOUNT
-        self.patch_properties(slot)
-        self.patch_mcdr_config(slot)
-        self.current_slot.release(self._config.mount_name)
+        if prepared is None:
+            prepared = MountPlan(self.prepare_properties(slot), self.prepare_mcdr_config(slot))
+        try:
+            self.mount_pipeline(slot, prepared).run()
+        except PipelineStuckError:
+            raise
+        except PipelineError as e:
+            logger().error(f'Failed to mount {slot.path} at step {e.step}: {e.cause}, rolled back')
+            psi.broadcast(RText(rtr('error.mount_failed', step=e.step, reason=e.cause), color=RColor.red))
+            self.cancel_mount(slot)
+            return
         self.current_slot, self.next_slot = slot, None
-        self._config.current_server = slot.path
-        self._config.save()
+
+    def mount_pipeline(self, slot: MountSlot, plan: MountPlan) -> Pipeline:
+        """
+        properties, mcdr config and releasing current slot are independent,
+        the plugin config is switched to the new slot only after all of them
+        """
+        timeout = self._config.mount_step_timeout
+        mount_name = self._config.mount_name
+        prev_slot = self.current_slot
+        prev_server = self._config.current_server
+        properties_file = os.path.join(slot.path, 'server.properties')
+        prev_properties: List[Optional[bytes]] = [None]
+        prev_mcdr_config = {}
+
+        def patch_properties():
+            try:
+                with open(properties_file, 'rb') as f:
+                    prev_properties[0] = f.read()
+            except FileNotFoundError:
+                pass
+            self.patch_properties(slot, plan.properties)
+
+        def undo_properties():
+            if plan.properties is None:
+                return
+            if prev_properties[0] is None:
+                os.remove(properties_file)
+            else:
+                PropertiesHelper.write(slot.path, prev_properties[0])
+
+        def patch_mcdr_config():
+            mcdr_config = psi.get_mcdr_config()
+            prev_mcdr_config.update({k: mcdr_config[k] for k in plan.mcdr_changes if k in mcdr_config})
+            self.patch_mcdr_config(plan.mcdr_changes)
+
+        def switch_config():
+            self._config.current_server = slot.path
+            self._config.save()
+
+        def undo_switch_config():
+            self._config.current_server = prev_server
+            self._config.save()
+
+        return Pipeline('mount') \
+            .add('properties', patch_properties, undo_properties, timeout=timeout) \
+            .add('mcdr_config', patch_mcdr_config, lambda: psi.modify_mcdr_config(changes=prev_mcdr_config),
+                 timeout=timeout) \
+            .add('release', lambda: prev_slot.release(mount_name), lambda: prev_slot.lock(mount_name),
+                 timeout=timeout) \
+            .add('plugin_config', switch_config, undo_switch_config,
+                 after=['properties', 'mcdr_config', 'release'], timeout=timeout)
 
     @single_op(Operation.IDLE)
     def abort_operation(self, source: CommandSource):
         debug("Received abort request, evaluating...")
         global current_op
-        current_op = Operation.IDLE
+        prev_op, current_op = current_op, Operation.IDLE
+        self.next_snapshot = None
         if not isinstance(self.next_slot, MountSlot):
             source.reply(rtr("error.nothing_to_abort"))
             return
-        if current_op is Operation.REQUEST_MOUNT:
+        if prev_op is Operation.REQUEST_MOUNT:
             self.next_slot.release(self._config.mount_name)
         self.next_slot = None
 
     @new_thread('mount-list')
     def list_servers(self, src: CommandSource, page: int = 1):
-        debug(f"Received list request for page {page}")
+        debug("Received list request for page %s", page)
         list_size = self._config.list_size
         available_servers = self._config.available_servers
         max_page = math.ceil(len(available_servers) / list_size)
@@ -312,15 +1053,64 @@ class MountManager:
         right = min(len(available_servers), page * list_size)
         src.reply(RText(rtr('list.title')))
         for server in available_servers[left: right]:
-            slot = MountSlot(path=server)
-            src.reply(
-                slot
-                    .get_config()
-                    .as_list_entry(slot.name, slot.path,
-                        self._config.mount_name, self._config.current_server
-                ))
+            src.reply(slot_cache.get(server).as_list_entry(self._config.mount_name, self._config.current_server,
+                                                           Lease(server, self._config.lease_ttl).owner()))
             
-        # <<<   curr/total   >>>
+        if left == right:
+            src.reply(rtr('list.empty'))
+        else:
+            src.reply(self.get_page_footer('--list', page, max_page))
+
+    def list_stats(self, src: CommandSource, sort_key: str = 'use_time', page: int = 1):
+        debug("Received stats request sorted by %s for page %s", sort_key, page)
+        if sort_key not in STATS_SORT_KEYS:
+            src.reply(rtr('error.stats.invalid_key', keys=', '.join(STATS_SORT_KEYS)))
+            return
+        stats_index.refresh(self._config.available_servers)
+        list_size = self._config.list_size
+        max_page = math.ceil(len(stats_index) / list_size)
+        if not 1 <= page <= max_page:
+            page = 1
+
+        left = (page - 1) * list_size
+        ranked = stats_index.rank(sort_key, left, page * list_size)
+        src.reply(RText(rtr('stats.title', sort_key=rtr(f'stats.sort_key.{sort_key}'))))
+        for i, (path, stats) in enumerate(ranked):
+            src.reply(RTextList(
+                RText(f'#{left + i + 1} ', color=RColor.gold),
+                RText(os.path.basename(os.path.normpath(path))).h(rtr("list.hover_on_name"))
+                .c(RAction.suggest_command, f"{COMMAND_PREFIX} --config {path}"),
+                ' ',
+                stats.display()
+            ))
+        if len(ranked) == 0:
+            src.reply(rtr('list.empty'))
+        else:
+            src.reply(self.get_page_footer(f'--stats {sort_key}', page, max_page))
+
+    def show_metrics(self, src: CommandSource, path: Optional[str] = None):
+        path = self.current_slot.path if path is None else path
+        debug("Received metrics request for %s", path)
+        runs = metrics.load_history().get(path, [])
+        src.reply(RText(rtr('metrics.title', path=path)))
+        if len(runs) == 0:
+            src.reply(rtr('list.empty'))
+            return
+        for op, phases in sorted(metrics.summarize(runs).items()):
+            total = phases.pop('total')
+            src.reply(RText(rtr('metrics.operation', op=op, num=len(total), last=round(total[-1], 1),
+                                p50=round(metrics.quantile(total, 0.5), 1),
+                                p95=round(metrics.quantile(total, 0.95), 1)), color=RColor.yellow))
+            for name, values in phases.items():
+                src.reply(rtr('metrics.phase', phase=name, last=round(values[-1], 2),
+                              p50=round(metrics.quantile(values, 0.5), 2),
+                              p95=round(metrics.quantile(values, 0.95), 2)))
+
+    @staticmethod
+    def get_page_footer(command: str, page: int, max_page: int) -> RTextBase:
+        """
+        <<<   curr/total   >>>
+        """
         link_color = {
             True: RColor.green,
             False: RColor.gray
@@ -331,25 +1121,20 @@ class MountManager:
             left_link = RText('<<<', color=link_color[False]).h(rtr('list.no_more_page'))
         else:
             left_link = RText('<<<', color=link_color[True]).h(rtr('list.prev_page')) \
-                .c(RAction.suggest_command, COMMAND_PREFIX + ' --list ' + str(page - 1))
+                .c(RAction.suggest_command, f'{COMMAND_PREFIX} {command} {page - 1}')
 
         right_link: RText
         if page >= max_page:
             right_link = RText('>>>', color=link_color[False]).h(rtr('list.no_more_page'))
         else:
             right_link = RText('>>>', color=link_color[True]).h(rtr('list.next_page')) \
-                .c(RAction.suggest_command, COMMAND_PREFIX + ' --list ' + str(page + 1))
+                .c(RAction.suggest_command, f'{COMMAND_PREFIX} {command} {page + 1}')
 
-        footer = RTextList(
+        return RTextList(
             left_link,
             f'   {page} / {max_page}   ',
             right_link
         )
-        if left == right:
-            src.reply(rtr('list.empty'))
-        else:
-            src.reply(footer)
-        
 
     def get_config(self, config_key, src: Optional[CommandSource] = None):
         if src is not None:
@@ -358,20 +1143,19 @@ class MountManager:
             return self._config.__getattribute__(config_key)
 
     def set_config(self, src: CommandSource, config_key, config_value):
-        debug(f"Setting config [{config_key}] to [{config_value}]")
+        debug("Setting config [%s] to [%s]", config_key, config_value)
         assert hasattr(self._config, config_key)
         self._config.__setattr__(name=config_key, value=config_value)
         self._config.save()
+        self._available_set = set(self._config.available_servers)
         src.reply(rtr("config.set_value", config_key, config_value))
 
     @staticmethod
     def list_path_config(src: CommandSource, path: str):
-        slot_instance = MountSlot(path)
-        src.reply(slot_instance.get_config().display(path))
-        del slot_instance
+        src.reply(slot_cache.get(path).config.display(path))
 
     def edit_path_config(self, src, path: CommandSource, key: str, value):
-        debug(f"Editing path({path}) config [{key}] to [{value}]")
+        debug("Editing path(%s) config [%s] to [%s]", path, key, value)
         slot_instance = MountSlot(path)
         src.reply(slot_instance.edit_config(key, value))
         self.current_slot.load_config()
@@ -1,49 +1,44 @@
 import os
 import time
-from asyncio import Event
-from threading import Lock, Thread
-from typing import Callable
-
-from jproperties import Properties
+from threading import Lock
+from typing import Iterable, List, Optional
 
 from .config import SlotConfig as Config
-from .constants import MOUNTABLE_CONFIG
-from .utils import logger, psi, rtr, debug
-
-
-class StatsChecker(Thread):
-    def __init__(self, interval: int, cb: Callable[[], None]):
-        super().__init__()
-        self.setDaemon(True)
-        self.setName(self.__class__.__name__)
-        self._report_time = time.time()
-        self.stop_event = Event()
-        self.interval = interval
-        self._callback = cb
-
-    def run(self):
-        while True: # loop until stop
-            while True: # # loop for report
-                if self.stop_event.wait(1):
-                    return
-                if time.time() - self._report_time > self.interval:
-                    break
-            self._report_time = time.time()
-            self._callback()
+from .lease import Lease
+from .scheduler import Task, scheduler
+from .slot_cache import slot_cache
+from .stats_index import stats_index
+from .stats_log import StatsLog
+from .storage import get_storage
+from .utils import logger, rtr, debug, span, trace
+
+STATS_TICK_INTERVAL = 60
 
-    def stop(self):
-        self.stop_event.set()
 
 class MountSlot:
-    def __init__(self, path: str):
+    def __init__(self, path: str, flush_interval: int = 0, lease_ttl: int = 60):
         self.path = path
+        self.lease = Lease(path, lease_ttl)
         self.load_config()
-        self.properties = Properties()
         self.slot_lock = Lock()
         self.__players = []
         self.__players_lock = Lock()
         self.__stats_lock = Lock()
-        self.__stats_checker = StatsChecker(60, self.update_stats)
+        # stats ticks and flushes run on the shared scheduler while mounted
+        self.__stats_tasks: Optional[List[Task]] = None
+        self.stats_log = StatsLog(path)
+        # stats are accumulated in memory and flushed at most once per flush_interval seconds
+        self.flush_interval = flush_interval
+        self.__flush_lock = Lock()
+        self.__stats_delta = {}
+        self.__last_tick_ns = time.time_ns()
+        self.__last_flush = 0.0
+        # since when no player is online while mounted, None if someone is online or not mounted
+        self.__empty_since: Optional[float] = None
+        # whether any player joined since mounted, an unused slot is not reset again when idle
+        self.__used = False
+        # the players online are unknown after a reload while the server is running, never idle then
+        self.__players_known = True
 
     @property
     def name(self) -> str:
@@ -57,20 +52,13 @@ class MountSlot:
             return os.path.join(self.path, self._config.plugin_dir)
 
     def load_config(self):
-        debug(f'Loading slot config in {self.path}...')
-        self._config = psi.load_config_simple(
-            target_class=Config,
-            file_name=os.path.join(self.path, MOUNTABLE_CONFIG),
-            in_data_folder=False
-        )
+        debug('Loading slot config in %s...', self.path)
+        self._config = get_storage().load(self.path)
 
     def save_config(self):
-        debug(f'Saving slot config in {self.path}...')
-        psi.save_config_simple(
-            config=self._config,
-            file_name=os.path.join(self.path, MOUNTABLE_CONFIG),
-            in_data_folder=False
-        )
+        debug('Saving slot config in %s...', self.path)
+        get_storage().save(self.path, self._config)
+        slot_cache.invalidate(self.path)
 
     def get_config(self) -> Config:
         return self._config
@@ -80,32 +68,32 @@ class MountSlot:
             return self._config.__getattribute__(item)
         raise AttributeError
 
-    def load_properties(self):
-        debug(f'Loading properties for slot {self.path}...')
-        try:
-            with open(os.path.join(self.path, 'server.properties'), 'rb') as f:
-                self.properties.load(f, 'utf-8')
-        except FileNotFoundError:
-            logger().error(f'No properties file for slot {self.path}!')
-
-    def save_properties(self):
-        debug(f'Saving properties for slot {self.path}...')
-        with open(os.path.join(self.path, 'server.properties'), 'wb') as f:
-            self.properties.store(f, encoding='utf-8')
-
     def lock(self, mount_name: str):
-        debug(f'Locking {self.path}...')
+        """
+        Take the lease of this slot, occupied_by in the config is kept for display only
+        :raise ResourceWarning: if the slot is leased to others
+        """
+        debug('Locking %s...', self.path)
         acquired = self.slot_lock.acquire(blocking=False)
         if acquired:
-            self.load_config()
-            if self._config.occupied_by in ["", None, mount_name]:
-                self._config.occupied_by = mount_name
-                self.save_config()
-                return
+            try:
+                if self.lease.acquire(mount_name):
+                    self.load_config()
+                    if self._config.occupied_by != mount_name:
+                        self._config.occupied_by = mount_name
+                        self.save_config()
+                    return
+            except (OSError, TimeoutError) as e:
+                logger().error(f'Failed to lease slot {self.path}: {e}')
+            self.slot_lock.release()
         raise ResourceWarning
 
     def release(self, mount_name: str):
-        debug(f'Releasing slot {self.path}...')
+        debug('Releasing slot %s...', self.path)
+        try:
+            self.lease.release(mount_name)
+        except (OSError, TimeoutError) as e:
+            logger().error(f'Failed to release lease of slot {self.path}: {e}')
         self.load_config()
         if self._config.occupied_by == mount_name:
             self._config.occupied_by = ""
@@ -113,7 +101,7 @@ class MountSlot:
         self.slot_lock.release()
 
     def edit_config(self, key: str, value: str):
-        debug(f'Editing slot config in {self.path}, [{key}]] set to [{value}]')
+        debug('Editing slot config in %s, [%s]] set to [%s]', self.path, key, value)
         if key in [ 'stats' ]:
             return rtr('config.cannot_edit', key=rtr(f'config.slot.{key}'))
         if isinstance(self._config.__getattribute__(key), bool):
@@ -124,57 +112,151 @@ class MountSlot:
                 value = False
             else:
                 return rtr('config.invalid_bool', value=value)
+        elif isinstance(self._config.__getattribute__(key), int):
+            try:
+                value = int(value)
+            except ValueError:
+                return rtr('config.invalid_int', value=value)
         self._config.__setattr__(key, value)
         self.save_config()
         return rtr('config.set_value', key=rtr(f'config.slot.{key}'), value=self._config.__getattribute__(key))
 
     def on_player_join(self, player: str):
-        debug(f'Player {player} joined slot {self.path}, saving stats...')
+        debug('Player %s joined slot %s, saving stats...', player, self.path)
         with self.__players_lock:
-            self.update_stats()
-            self._config.stats.total_players = self._config.stats.total_players + 1
+            self.update_stats(flush=False)
+            with self.__stats_lock:
+                self.__add_delta('total_players', 1)
             self.__players.append(player)
-            self.update_stats()
+            self.__empty_since = None
+            self.__used = True
+        trace('player_join', slot=self.path, player=player)
+        self.stats_log.append('join', player)
+        self.flush_stats()
 
     def on_player_left(self, player: str):
-        debug(f'Player {player} left slot {self.path}, saving stats...')
+        debug('Player %s left slot %s, saving stats...', player, self.path)
         try:
             with self.__players_lock:
-                self.update_stats()
+                self.update_stats(flush=False)
                 self.__players.remove(player)
+                if len(self.__players) == 0 and self.__stats_tasks is not None and self.__players_known:
+                    self.__empty_since = time.time()
         except ValueError:
             pass
+        trace('player_left', slot=self.path, player=player)
+        self.stats_log.append('leave', player)
+        self.flush_stats()
 
     def on_mount(self):
-        debug(f'slot {self.path} is mounted, saving stats...')
-        if not self.__stats_checker.is_alive:
-            with self.__stats_lock:
-                current = time.time_ns
-                self._config.stats.last_mount_ns = current
-                self.save_config()
-            debug(f'starting stats checker for slot {self.path}...')
-            self.__stats_checker.start()
+        debug('slot %s is mounted, saving stats...', self.path)
+        if self.__stats_tasks is not None:
+            return
+        self.stats_log.append('mount')
+        with self.__players_lock:
+            self.__empty_since = time.time() if self.__players_known and len(self.__players) == 0 else None
+            self.__used = len(self.__players) > 0
+        with self.__stats_lock:
+            self.__last_tick_ns = time.time_ns()
+            self.__stats_delta['last_mount_ns'] = self.__last_tick_ns
+            self.__stats_tasks = [
+                scheduler.schedule(STATS_TICK_INTERVAL, self.on_stats_tick, f'stats tick of {self.name}')]
+            if self.flush_interval > 0:
+                # deltas left by join and leave are written even if nothing else happens
+                self.__stats_tasks.append(scheduler.schedule(
+                    self.flush_interval, lambda: self.flush_stats(force=True), f'stats flush of {self.name}'))
+        self.flush_stats(force=True)
 
     def on_unmount(self):
-        debug(f'slot {self.path} is unmounted, saving stats...')
-        if self.__stats_checker.is_alive:
-            self.update_stats()
-            self.__stats_checker.stop()
+        debug('slot %s is unmounted, saving stats...', self.path)
+        if self.__stats_tasks is not None:
+            self.update_stats(flush=False)
+            with self.__stats_lock:
+                for task in self.__stats_tasks:
+                    task.cancel()
+                self.__stats_tasks = None
+            self.stats_log.append('unmount')
+            with self.__players_lock:
+                self.__empty_since = None
+                # nobody is online once the server stops
+                self.__players = []
+                self.__players_known = True
+        self.flush_stats(force=True)
 
 
-    def update_stats(self):
-        debug(f'Updating stats in slot {self.path}...')
-        if not self.__stats_checker.is_alive:
-            return
+    def seed_players(self, players: Optional[Iterable[str]]):
+        """
+        Set the players online before on_mount, e.g. listed by rcon after a reload, None if unknown
+        """
+        with self.__players_lock:
+            self.__players_known = players is not None
+            self.__players = [] if players is None else list(players)
+
+    def idle_seconds(self) -> float:
+        """
+        :return: how long the mounted slot has no player online, 0 if someone is online or not mounted
+        """
+        with self.__players_lock:
+            return 0.0 if self.__empty_since is None else time.time() - self.__empty_since
+
+    @property
+    def used(self) -> bool:
+        return self.__used
+
+    def mark_active(self):
+        """
+        Restart the idle time, e.g. after the idle actions are taken
+        """
+        with self.__players_lock:
+            if self.__empty_since is not None:
+                self.__empty_since = time.time()
+            self.__used = False
+
+    def __add_delta(self, key: str, value: int):
+        self.__stats_delta[key] = self.__stats_delta.get(key, 0) + value
+
+    def on_stats_tick(self):
+        self.update_stats()
+        try:
+            self.stats_log.compact()
+        except OSError as e:
+            logger().error(f'Failed to compact stats log of slot {self.path}: {e}')
+
+    def update_stats(self, flush: bool = True):
+        debug('Updating stats in slot %s...', self.path)
         with self.__stats_lock:
+            if self.__stats_tasks is None:
+                return
             current = time.time_ns()
-            prev = self._config.stats.last_mount_ns
             p = len(self.__players)
-            t = current - prev
+            t = current - self.__last_tick_ns
+            self.__last_tick_ns = current
+            self.__add_delta('total_use_time', t)
+            self.__add_delta('total_player_time', t * p)
+            self.__stats_delta['last_mount_ns'] = current
+        trace('stats_update', slot=self.path, players=p, elapsed_ns=t)
+        if flush:
+            self.flush_stats()
+
+    def flush_stats(self, force: bool = False):
+        """
+        Write the accumulated stats into the mountable config, at most once per flush interval unless forced
+        """
+        with self.__stats_lock:
+            if len(self.__stats_delta) == 0 \
+                    or (not force and time.time() - self.__last_flush < self.flush_interval):
+                return
+            delta, self.__stats_delta = self.__stats_delta, {}
+            self.__last_flush = time.time()
+        with self.__flush_lock, span('stats_flush', slot=self.path, delta=delta):
+            # reload first, the config may be edited by others since last load
+            self.load_config()
             stats = self._config.stats
-            stats.last_mount_ns = current
-            stats.total_use_time = stats.total_use_time + t
-            stats.total_player_time = stats.total_player_time + t * p
-            self._config.stats = stats
-            debug(f'current stats: {stats}')
+            for key, value in delta.items():
+                if key == 'last_mount_ns':
+                    stats.last_mount_ns = value
+                else:
+                    stats.__setattr__(key, stats.__getattribute__(key) + value)
+            debug('current stats: %s', stats)
             self.save_config()
+            stats_index.update(self.path, stats)
@@ -0,0 +1,70 @@
+from typing import Callable, Iterable, List, Optional
+
+from .config import SlotSummary
+from .lease import Lease
+from .slot_cache import slot_cache
+from .storage import get_storage
+from .utils import debug, trace
+
+
+class SlotFilter:
+    """
+    Filter of --any, space separated terms which all must match:
+    tag:<tag> for a tag in tags, handler:<handler> for the handler, any other word for a part of desc
+    """
+    def __init__(self, text: str = ''):
+        self.text = text
+        self.tags: List[str] = []
+        self.handlers: List[str] = []
+        self.words: List[str] = []
+        for term in text.split():
+            if term.startswith('tag:'):
+                self.tags.append(term[4:].lower())
+            elif term.startswith('handler:'):
+                self.handlers.append(term[8:])
+            else:
+                self.words.append(term.lower())
+
+    def matches(self, summary: SlotSummary) -> bool:
+        config = summary.config
+        tags = config.tag_set()
+        desc = config.desc.lower()
+        return all(i in tags for i in self.tags) \
+            and all(i == config.handler for i in self.handlers) \
+            and all(i in desc for i in self.words)
+
+
+class Allocator:
+    """
+    Pick a free slot from the pool shared by the instances, least recently mounted first
+    """
+    def __init__(self, lease_ttl: int):
+        self.lease_ttl = lease_ttl
+
+    def candidates(self, paths: Iterable[str], slot_filter: SlotFilter, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        :return: checked slots matching the filter and not leased to anyone, least recently mounted first
+        """
+        exclude = set(exclude)
+        summaries = [slot_cache.get(i) for i in get_storage().find(paths, checked=True) if i not in exclude]
+        summaries = [i for i in summaries if slot_filter.matches(i)]
+        # occupied_by may be left by a crash, the lease is what tells if the slot is in use
+        summaries = [i for i in summaries if Lease(i.path, self.lease_ttl).owner() == '']
+        summaries.sort(key=lambda i: i.config.stats.last_mount_ns)
+        return [i.path for i in summaries]
+
+    def allocate(self, paths: Iterable[str], slot_filter: SlotFilter, claim: Callable[[str], bool],
+                 exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        :param claim: take the slot atomically, False if another instance is faster
+        :return: the claimed slot, None if no candidate is left
+        """
+        candidates = self.candidates(paths, slot_filter, exclude)
+        debug('Allocating a slot for [%s] from %s', slot_filter.text, candidates)
+        for path in candidates:
+            if claim(path):
+                trace('slot_allocated', filter=slot_filter.text, path=path, candidates=len(candidates))
+                return path
+            debug('Lost slot %s to another instance, trying the next one', path)
+        trace('slot_allocate_failed', filter=slot_filter.text, candidates=len(candidates))
+        return None
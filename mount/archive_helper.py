@@ -0,0 +1,204 @@
+import gzip
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from .constants import MANIFEST_NAME, RESERVE_DIRS, WORLDS
+from .utils import debug, logger
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed by .tar.zst templates
+    zstandard = None
+
+ARCHIVE_FORMATS = {
+    '.tar.zst': 'tar.zst',
+    '.tar.zstd': 'tar.zst',
+    '.tar.gz': 'tar.gz',
+    '.tgz': 'tar.gz',
+    '.tar': 'tar',
+    '.zip': 'zip'
+}
+BUFFER_SIZE = 1 << 20
+
+
+def get_format(path: str) -> Optional[str]:
+    for suffix, fmt in ARCHIVE_FORMATS.items():
+        if path.lower().endswith(suffix):
+            return fmt
+    return None
+
+
+def default_format() -> str:
+    return 'tar.zst' if zstandard is not None else 'tar.gz'
+
+
+def is_wanted(name: str, reset_type: str) -> bool:
+    """
+    Only world dirs are extracted, reserved dirs are kept in region mode
+    """
+    parts = [i for i in name.replace('\\', '/').split('/') if i not in ['', '.']]
+    if len(parts) == 0 or parts[0] not in WORLDS or '..' in parts:
+        return False
+    return not (reset_type == 'region' and parts[0] == 'world' and len(parts) > 1 and parts[1] in RESERVE_DIRS)
+
+
+class ArchiveHelper:
+    @staticmethod
+    def is_archive(path: str) -> bool:
+        return os.path.isfile(path) and get_format(path) is not None
+
+    @staticmethod
+    def check(archive: str, reset_type: str = 'full') -> Tuple[int, int]:
+        """
+        Read through the archive without extracting anything, so a reset won't delete the worlds
+        and then find it can't be extracted
+        :return: files and bytes to extract
+        :raise ValueError: if the format is unknown, its codec is missing, or the archive is broken or has no world
+        """
+        fmt = get_format(archive)
+        if fmt is None:
+            raise ValueError(f'Unknown archive format: {archive}')
+        if fmt == 'tar.zst' and zstandard is None:
+            raise ValueError('zstandard is required to extract .tar.zst archive')
+        debug('Checking archive %s', archive)
+        files, size = 0, 0
+        try:
+            if fmt == 'zip':
+                with zipfile.ZipFile(archive) as zf:
+                    bad = zf.testzip()
+                    if bad is not None:
+                        raise ValueError(f'{bad} is broken')
+                    for info in zf.infolist():
+                        if is_wanted(info.filename, reset_type) and not info.is_dir():
+                            files += 1
+                            size += info.file_size
+            else:
+                with ArchiveHelper._open_tar(archive, fmt) as tar:
+                    # members are skipped by reading their data, a truncated archive fails here
+                    for member in tar:
+                        if is_wanted(member.name, reset_type) and member.isfile():
+                            files += 1
+                            size += member.size
+                    # read up to the end of the compressed stream, where its checksum is verified
+                    while len(tar.fileobj.read(BUFFER_SIZE)) > 0:
+                        pass
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+            raise ValueError(f'Broken archive {archive}: {e}') from e
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise ValueError(f'Broken archive {archive}: {e}') from e
+            raise
+        if files == 0:
+            raise ValueError(f'No world in archive {archive}')
+        return files, size
+
+    @staticmethod
+    @contextmanager
+    def _open_tar(archive: str, fmt: str) -> Iterator[tarfile.TarFile]:
+        if fmt == 'tar.zst':
+            with open(archive, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    yield tar
+            return
+        if fmt == 'tar.gz':
+            # tarfile doesn't verify the gzip checksum, GzipFile does at the end of the stream
+            with gzip.open(archive, 'rb') as f, tarfile.open(fileobj=f, mode='r|') as tar:
+                yield tar
+            return
+        with tarfile.open(archive, mode='r|*') as tar:
+            yield tar
+
+    @staticmethod
+    def extract(archive: str, target: str, reset_type: str = 'full') -> Tuple[int, int]:
+        """
+        Stream the world dirs in archive into target, without any intermediate copy
+        :return: files and bytes extracted
+        """
+        fmt = get_format(archive)
+        logger().info(f'Extracting {archive} into {target}...')
+        if fmt == 'zip':
+            return ArchiveHelper._extract_zip(archive, target, reset_type)
+        if fmt == 'tar.zst' and zstandard is None:
+            raise RuntimeError('zstandard is required to extract .tar.zst archive')
+        with ArchiveHelper._open_tar(archive, fmt) as tar:
+            return ArchiveHelper._extract_tar(tar, target, reset_type)
+
+    @staticmethod
+    def _extract_tar(tar: tarfile.TarFile, target: str, reset_type: str) -> Tuple[int, int]:
+        counter = [0, 0]
+
+        def members() -> Iterator[tarfile.TarInfo]:
+            for member in tar:
+                if not is_wanted(member.name, reset_type):
+                    debug('Skip %s in archive', member.name)
+                    continue
+                if member.isfile():
+                    counter[0] += 1
+                    counter[1] += member.size
+                yield member
+
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(target, members=members(), filter='data')
+        else:
+            tar.extractall(target, members=members())
+        return counter[0], counter[1]
+
+    @staticmethod
+    def _extract_zip(archive: str, target: str, reset_type: str) -> Tuple[int, int]:
+        files, size = 0, 0
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not is_wanted(info.filename, reset_type):
+                    continue
+                dst = os.path.join(target, *[i for i in info.filename.split('/') if i not in ['', '.']])
+                if info.is_dir():
+                    os.makedirs(dst, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                with zf.open(info) as fsrc, open(dst, 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                os.utime(dst, (mtime, mtime))
+                files += 1
+                size += info.file_size
+        return files, size
+
+    @staticmethod
+    def pack(src: str, archive: str) -> int:
+        """
+        Pack the template dir src into archive, the format is decided by the suffix of archive
+        :return: size of the archive
+        """
+        fmt = get_format(archive)
+        if fmt is None:
+            raise ValueError(f'Unknown archive format: {archive}')
+        logger().info(f'Packing {src} into {archive}...')
+        tmp = archive + '.tmp'
+        names = sorted(i for i in os.listdir(src) if i != MANIFEST_NAME)
+        if fmt == 'zip':
+            with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                for name in names:
+                    for root, dirs, files in os.walk(os.path.join(src, name)):
+                        rel_root = os.path.relpath(root, src)
+                        zf.write(root, rel_root)
+                        for file in files:
+                            zf.write(os.path.join(root, file), os.path.join(rel_root, file))
+        elif fmt == 'tar.zst':
+            if zstandard is None:
+                raise RuntimeError('zstandard is required to create .tar.zst archive')
+            compressor = zstandard.ZstdCompressor(threads=-1, write_checksum=True)
+            with open(tmp, 'wb') as f, compressor.stream_writer(f) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    for name in names:
+                        tar.add(os.path.join(src, name), name)
+        else:
+            with tarfile.open(tmp, mode='w|gz' if fmt == 'tar.gz' else 'w|') as tar:
+                for name in names:
+                    tar.add(os.path.join(src, name), name)
+        os.replace(tmp, archive)
+        return os.path.getsize(archive)
@@ -1,4 +1,4 @@
-from mcdreforged.api.command import GreedyText, Literal, Text, Number
+from mcdreforged.api.command import GreedyText, Integer, Literal, Text, Number
 from mcdreforged.api.rtext import RAction, RColor, RText, RTextList
 from mcdreforged.api.types import CommandSource, PluginServerInterface
 
@@ -14,7 +14,7 @@ def get_clickable(cmd: str):
 
 
 def get_help(src: CommandSource):
-    sub_command = ['reset', 'list', 'reload', 'config']
+    sub_command = ['any', 'reset', 'rollback', 'list', 'stats', 'metrics', 'reload', 'config', 'pack', 'compact', 'store', 'registry', 'queue', 'patch-all']
     payload = RTextList(RText(rtr('help_msg.title', version=psi.get_self_metadata().version)), '\n')
     payload.append(
         get_clickable('<server_name>'),
@@ -50,7 +50,7 @@ def register_commands(server: PluginServerInterface, manager: MountManager):
         'short_prefix') else COMMAND_PREFIX
 
     def get_slot_node():  # to check if is a usable slot
-        return Text('slot_path').requires(lambda src, ctx: ctx['slot_path'] in manager.servers_as_list,
+        return Text('slot_path').requires(lambda src, ctx: manager.is_available(ctx['slot_path']),
                                           lambda src, ctx: rtr('error.invalid_mount_path'))
 
     config_node = Literal({"--config", "-cfg"}).runs(lambda src: get_config_help(src))\
@@ -65,10 +65,56 @@ def register_commands(server: PluginServerInterface, manager: MountManager):
                 lambda src, ctx: manager.edit_path_config(
                     src, ctx['slot_path'], ctx['key'], ctx['value'])
             )))))
+    pack_node = Literal('--pack')\
+        .requires(lambda src: src.has_permission(3), lambda src: src.reply(rtr('error.perm_deny'))).then(
+        get_slot_node().runs(lambda src, ctx: manager.pack_reset_path(src, ctx['slot_path']))
+        .then(Text('format').runs(lambda src, ctx: manager.pack_reset_path(src, ctx['slot_path'], ctx['format']))))
+    compact_node = Literal('--compact')\
+        .requires(lambda src: src.has_permission(3), lambda src: src.reply(rtr('error.perm_deny'))).then(
+        get_slot_node().runs(lambda src, ctx: manager.compact_reset_path(src, ctx['slot_path'])))
+    store_node = Literal('--store')\
+        .requires(lambda src: src.has_permission(3), lambda src: src.reply(rtr('error.perm_deny'))).then(
+        Literal('import').runs(lambda src, ctx: manager.store_import(src))
+        .then(get_slot_node().runs(lambda src, ctx: manager.store_import(src, ctx['slot_path'])))
+    ).then(
+        Literal('gc').runs(lambda src, ctx: manager.store_gc(src))
+    )
+    registry_node = Literal('--registry')\
+        .requires(lambda src: src.has_permission(3), lambda src: src.reply(rtr('error.perm_deny')))\
+        .runs(lambda src: manager.show_registry(src))\
+        .then(Literal('import').runs(lambda src: manager.registry_import(src)))\
+        .then(Literal('export').runs(lambda src: manager.registry_export(src)))
+    def with_triggers(node, op: str, get_path):
+        """
+        [at <time> | empty | next] after the operation, default to next
+        """
+        return node.runs(lambda src, ctx: manager.queue_operation(src, op, get_path(ctx)))\
+            .then(Literal('at').then(Text('time').runs(
+                lambda src, ctx: manager.queue_operation(src, op, get_path(ctx), 'at', ctx['time']))))\
+            .then(Literal('empty').runs(lambda src, ctx: manager.queue_operation(src, op, get_path(ctx), 'empty')))\
+            .then(Literal('next').runs(lambda src, ctx: manager.queue_operation(src, op, get_path(ctx), 'next')))
+
+    queue_node = Literal('--queue')\
+        .requires(lambda src: src.has_permission(3), lambda src: src.reply(rtr('error.perm_deny')))\
+        .runs(lambda src: manager.list_queue(src))\
+        .then(Literal('mount').then(with_triggers(get_slot_node(), 'mount', lambda ctx: ctx['slot_path'])))\
+        .then(with_triggers(Literal('reset'), 'reset', lambda ctx: ''))\
+        .then(Literal('remove').then(Integer('id').runs(lambda src, ctx: manager.remove_queued(src, ctx['id']))))\
+        .then(Literal('clear').runs(lambda src: manager.remove_queued(src)))
+    patch_node = Literal('--patch-all')\
+        .requires(lambda src: src.has_permission(3), lambda src: src.reply(rtr('error.perm_deny')))\
+        .runs(lambda src: manager.patch_all_properties(src))\
+        .then(Literal('preview').runs(lambda src: manager.patch_all_properties(src, dry_run=True)))
     main_node = Literal(root_prefix).runs(
         lambda src: get_help(src)
+    ).then(
+        Literal('--any').runs(lambda src: manager.request_mount_any(src))
+        .then(GreedyText('filter').runs(lambda src, ctx: manager.request_mount_any(src, ctx['filter'])))
     ).then(
         Literal({'--reset', '-rs'}).runs(lambda src: manager.request_reset(src))
+    ).then(
+        Literal('--rollback').runs(lambda src: manager.request_rollback(src))
+        .then(Text('snapshot').runs(lambda src, ctx: manager.request_rollback(src, ctx['snapshot'])))
     ).then(
         Literal('--confirm').runs(lambda src, ctx: manager.confirm_operation(src))
     ).then(
@@ -77,10 +123,32 @@ def register_commands(server: PluginServerInterface, manager: MountManager):
         ).then(
             Number('page').runs(lambda src, ctx: manager.list_servers(src, ctx['page']))
         )
+    ).then(
+        Literal('--stats').runs(
+            lambda src, ctx: manager.list_stats(src)
+        ).then(
+            Text('sort_key').runs(lambda src, ctx: manager.list_stats(src, ctx['sort_key']))
+            .then(Number('page').runs(lambda src, ctx: manager.list_stats(src, ctx['sort_key'], ctx['page'])))
+        )
+    ).then(
+        Literal('--metrics').runs(lambda src, ctx: manager.show_metrics(src))
+        .then(get_slot_node().runs(lambda src, ctx: manager.show_metrics(src, ctx['slot_path'])))
     ).then(
         Literal('--abort').runs(lambda src, ctx: manager.abort_operation(src))
     ).then(
         config_node
+    ).then(
+        pack_node
+    ).then(
+        compact_node
+    ).then(
+        store_node
+    ).then(
+        registry_node
+    ).then(
+        queue_node
+    ).then(
+        patch_node
     ).then(
         Literal({'--reload', '-r'}).runs(lambda src, ctx: manager.reload(src))
     ).then(
@@ -1,10 +1,12 @@
-from typing import List, Union
+import os
+import time
+from typing import List, Optional, Set, Union
 
 from mcdreforged.api.rtext import *
 from mcdreforged.api.utils import Serializable
 
-from .constants import COMMAND_PREFIX, CONFIG_NAME
-from .utils import debug, psi, rtr, setDebugNoCheck
+from .constants import COMMAND_PREFIX, CONFIG_NAME, TRACE_FILE
+from .utils import debug, psi, rtr, setDebugNoCheck, setTrace
 
 
 class MountConfig(Serializable):
@@ -20,6 +22,43 @@ class MountConfig(Serializable):
     current_server: str = "../servers/Parkour"
     mount_name: str = "MountDemo"
     list_size: int = 15
+    # stats of current slot are written into its config at most once per this many seconds
+    stats_flush_interval: int = 30
+    # watch servers path for new, removed and ignored slots, with inotify if available or polling otherwise
+    watch_servers: bool = False
+    # debounce time of the watcher, also the polling interval, in seconds
+    watch_interval: float = 2.0
+    # workers used to delete and copy files when resetting, thread or process pool,
+    # process needs fork and falls back to thread without it, e.g. on windows
+    reset_workers: int = 4
+    reset_executor: str = "thread"
+    # content-addressed store shared by the reset paths of all slots, empty for disable,
+    # should be on the same filesystem with the slots. Imported template files become read-only links of the store,
+    # copy a template before editing it in place
+    store_path: str = ""
+    # timed mount/reset/rollback operations kept per slot for --metrics and the exports in the data folder
+    metrics_history: int = 50
+    # skip the restart countdown of mount/reset/rollback if no player is online
+    skip_empty_countdown: bool = True
+    # lightweight slot mounted when a slot is released for idle, see idle_minutes of slots, empty for disable
+    idle_server: str = ""
+    # check and prepare mount/reset during the restart countdown, the server is only stopped for the commit
+    prepared_restart: bool = True
+    # timeout in seconds of each step of mount, a failed mount is rolled back and the current slot is kept
+    mount_step_timeout: int = 30
+    # slots are leased to this instance with a heartbeat every lease_ttl / 3 seconds,
+    # a lease without heartbeat for lease_ttl seconds, e.g. left by a crash, is reclaimed by others
+    lease_ttl: int = 60
+    # write spans and events of hot paths into trace.log in the data folder, sampled by trace_sample_rate
+    trace: bool = False
+    trace_sample_rate: float = 1.0
+    # size of each trace file in MB, 3 rotated files are kept
+    trace_file_mb: int = 10
+    # where the slot configs are kept, json for mountable.json in every slot, sqlite for a registry shared by
+    # the instances whose registry_path points to the same file on a local filesystem, registry_path defaults
+    # to registry.db in the data folder, which is not shared
+    registry: str = "json"
+    registry_path: str = ""
     debug: bool = False
 
     def migrate(self):
@@ -31,7 +70,7 @@ class MountConfig(Serializable):
             self.save()
 
     def save(self):
-        debug(f'Saving plugin config...')
+        debug('Saving plugin config...')
         psi.save_config_simple(
             config=self, file_name=CONFIG_NAME, in_data_folder=False)
     
@@ -39,6 +78,8 @@ class MountConfig(Serializable):
     def load() -> 'MountConfig':
         config = psi.load_config_simple(file_name=CONFIG_NAME, target_class=MountConfig, in_data_folder=False)
         setDebugNoCheck(config.debug)
+        setTrace(os.path.join(psi.get_data_folder(), TRACE_FILE) if config.trace else None,
+                 config.trace_sample_rate, config.trace_file_mb)
         config.migrate()
         return config
 
@@ -50,12 +91,25 @@ class SlotStats(Serializable):
     total_players: int = 0
 
     def display(self) -> RTextBase:
-        # [TODO) display stats to users
-        return RText('')
+        if self.last_mount_ns < 0:
+            last_mount = rtr('stats.never')
+        else:
+            last_mount = time.strftime('%Y-%m-%d %H:%M', time.localtime(self.last_mount_ns / 1e9))
+        return RTextList(
+            RText(rtr('stats.use_time', hours=round(self.total_use_time / 3.6e12, 1)), color=RColor.aqua),
+            ' ',
+            RText(rtr('stats.player_time', hours=round(self.total_player_time / 3.6e12, 1)), color=RColor.green),
+            ' ',
+            RText(rtr('stats.players', num=self.total_players), color=RColor.yellow),
+            ' ',
+            RText(rtr('stats.last_mount', time=last_mount), color=RColor.gray)
+        )
 
 class SlotConfig(Serializable):
     checked: bool = False
     desc: str = "Demo server"
+    # comma separated tags, matched by tag:<tag> in --any
+    tags: str = ""
     start_command: str = "./start.sh"
     handler: str = "vanilla_handler"
 
@@ -64,13 +118,35 @@ class SlotConfig(Serializable):
     # backup path for reset, empty for disable, should be relative to mc server path
     reset_path: str = ""
     reset_type: str = "full"
+    # how to copy the reset path, reflink for copy-on-write clone, fallback to copy if unsupported
+    reset_mode: str = "copy"
+    # only restore the files differ from the reset path, checked by a manifest of the reset path
+    incremental_reset: bool = False
+    # fresh copies of reset path kept ready while running, so reset only swaps the worlds, 0 for disable
+    staged_worlds: int = 0
+    # disk budget of the staged copies in MB, 0 for unlimited
+    stage_budget_mb: int = 0
+    # snapshots of the worlds taken right before reset, used by rollback, 0 for disable. With incremental reset
+    # and no staged worlds, only the changed files are kept, the rest are restored from the reset path on rollback
+    snapshot_count: int = 0
+    # snapshots older than this or beyond the disk budget are evicted, 0 for no limit
+    snapshot_max_age_hours: int = 0
+    snapshot_budget_mb: int = 0
 
     # mcdr plugin path for specific plugin, empty for disable, should be relative to mc server path
     plugin_dir: str = ""
 
+    # minutes without player online before the idle action, 0 for disable
+    idle_minutes: int = 0
+    # reset, release or both, release mounts the idle server of the mcdr instance and frees this slot
+    idle_action: str = "release"
+
     # slot stats, used for rank
     stats: SlotStats = SlotStats()
 
+    def tag_set(self) -> Set[str]:
+        return set(i.strip().lower() for i in self.tags.split(',') if i.strip() != '')
+
     def display(self, server_path: str):
         conf_list = self.get_field_annotations()
 
@@ -81,7 +157,7 @@ class SlotConfig(Serializable):
             if config_value in ['', None, '.']:
                 config_value_str = rtr('config.empty')
             elif config_key == 'stats':
-                return RText('')
+                return RTextList(rtr('config.slot.stats'), ': ', config_value.display(), '\n')
             elif isinstance(config_value, bool):
                 suggested_value = not config_value
                 config_value_str = rtr(f'config.bool.{"positive" if config_value else "negative"}')
@@ -96,10 +172,29 @@ class SlotConfig(Serializable):
         return payload
 
 
-    def as_list_entry(self, name: str, server_path: str, mount_name: str, current_mount: str):
+class SlotSummary:
+    """
+    Read-only summary of a slot config, used to render lists without a full MountSlot
+    """
+    __slots__ = ('path', 'name', 'checked', 'desc', 'occupied_by', 'reset_path', 'config')
+
+    def __init__(self, path: str, config: SlotConfig):
+        for key, value in (('path', path), ('name', os.path.basename(os.path.normpath(path))),
+                           ('checked', config.checked), ('desc', config.desc),
+                           ('occupied_by', config.occupied_by), ('reset_path', config.reset_path),
+                           ('config', config)):
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is read-only')
+
+    def as_list_entry(self, mount_name: str, current_mount: str, occupied_by: Optional[str] = None):
         """
         - path [↻] <desc_short>
+        :param occupied_by: owner of the slot lease, default to occupied_by in the config
         """
+        name, server_path = self.name, self.path
+        occupied_by = self.occupied_by if occupied_by is None else occupied_by
 
         def get_button() -> RTextBase:
             error_button = RText("[?]", color=RColor.red).h(
@@ -107,7 +202,7 @@ class SlotConfig(Serializable):
             mount_button = RText("[▷]")
             reset_button = RText("[↻]", color=RColor.yellow).c(RAction.suggest_command,
                                                                COMMAND_PREFIX + " --reset")
-            if server_path == current_mount and mount_name == self.occupied_by:
+            if server_path == current_mount and mount_name == occupied_by:
                 if self.reset_path in ["", None, '.']:
                     reset_button.set_color(RColor.gray).h(
                         rtr("list.reset_btn.unusable"))
@@ -117,12 +212,12 @@ class SlotConfig(Serializable):
                 return reset_button
             elif not self.checked:
                 return mount_button.set_color(RColor.gray).h(rtr('list.mount_btn.uncheck'))
-            elif self.occupied_by in [None, ""]:
+            elif occupied_by in [None, ""]:
                 return mount_button.h(rtr("list.mount_btn.normal", server_name=server_path)) \
                     .set_color(RColor.green).c(RAction.suggest_command, COMMAND_PREFIX + " " + server_path)
-            elif self.occupied_by != mount_name and server_path != current_mount:
+            elif occupied_by != mount_name and server_path != current_mount:
                 return mount_button.set_color(RColor.gray).h(
-                    rtr("list.mount_btn.occupied", occupied_by=self.occupied_by))
+                    rtr("list.mount_btn.occupied", occupied_by=occupied_by))
             else:
                 return error_button
 
@@ -132,10 +227,10 @@ class SlotConfig(Serializable):
             if not self.checked:
                 path_text.set_color(RColor.gray).set_styles(
                     RStyle.strikethrough)
-            elif server_path == current_mount and mount_name == self.occupied_by:
+            elif server_path == current_mount and mount_name == occupied_by:
                 path_text.set_color(
                     RColor.light_purple).set_styles(RStyle.bold)
-            elif self.occupied_by in ["", None]:
+            elif occupied_by in ["", None]:
                 path_text.set_color(RColor.green)
             else:
                 path_text.set_color(RColor.red)
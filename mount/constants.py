@@ -2,3 +2,29 @@ COMMAND_PREFIX = "!!mount"
 CONFIG_NAME = "config/mount.json"
 MOUNTABLE_CONFIG = "mountable.json"
 IGNORE_PATTEN = ".mount-ignore"
+MANIFEST_NAME = ".mount-manifest.json"
+# stored in the data folder of this plugin
+DETECT_CACHE = "detect_cache.json"
+METRICS_FILE = "metrics.json"
+METRICS_EXPORT = "metrics.prom"
+METRICS_PENDING = "metrics_pending.json"
+TRACE_FILE = "trace.log"
+REGISTRY_FILE = "registry.db"
+QUEUE_FILE = "queue.json"
+STAGE_DIR = ".mount-staged"
+STAGE_MARK = ".mount-stage"
+TRASH_DIR = ".mount-trash"
+# left in a trash dir whose worlds couldn't be moved back after a failed swap, kept by cleanup
+SWAP_FAILED_MARK = ".mount-swap-failed"
+LEASE_FILE = ".mount-lease"
+SNAPSHOT_DIR = ".mount-snapshots"
+# in a snapshot left by a failed rollback, never evicted
+SNAPSHOT_KEEP_MARK = ".mount-keep"
+# files of a partial snapshot taken before incremental reset, the rest are restored from the reset path
+SNAPSHOT_PARTIAL = ".mount-partial.json"
+STATS_DIR = ".mount-stats"
+
+# dirs kept when resetting with region type
+RESERVE_DIRS = ["playerdata", "advancements", "stats"]
+WORLDS = ["world", "world_nether", "world_the_end"]
+
@@ -1,11 +1,14 @@
+import json
 import os
-from typing import Iterable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from mcdreforged.api.types import PluginServerInterface
 
 from .config import SlotConfig
-from .constants import IGNORE_PATTEN, MOUNTABLE_CONFIG
-from .utils import debug, psi
+from .constants import IGNORE_PATTEN
+from .storage import get_storage
+from .utils import debug, logger
 
 def is_ignored_slot(path: str) -> bool:
     """
@@ -13,40 +16,95 @@ def is_ignored_slot(path: str) -> bool:
     """
     return os.path.isfile(os.path.join(path, IGNORE_PATTEN))
 
+
+def scan_root(root: str, cached: Optional[dict]) -> dict:
+    """
+    Scan the sub dirs of a detect path
+    :param cached: previous result of this root, the listing is skipped if the mtime of root is unchanged
+    :return: mtime of root, and [mtime, ignored] of every sub dir by name
+    """
+    root_mtime = os.stat(root).st_mtime_ns
+    children: Dict[str, list] = {}
+    if cached is not None and cached.get('mtime_ns') == root_mtime:
+        # no entry added or removed, only check the sub dirs for toggled ignore file
+        for name, (mtime, ignored) in cached['children'].items():
+            try:
+                child_mtime = os.stat(os.path.join(root, name)).st_mtime_ns
+            except OSError:
+                continue
+            if child_mtime != mtime:
+                ignored = is_ignored_slot(os.path.join(root, name))
+            children[name] = [child_mtime, ignored]
+    else:
+        debug('%s changed, scanning...', root)
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir():
+                    children[entry.name] = [entry.stat().st_mtime_ns, is_ignored_slot(entry.path)]
+    return {'mtime_ns': root_mtime, 'children': children}
+
+
 class DetectHelper:
     @staticmethod
-    def detect_slots(detect_paths: Iterable[str], prev_slots: Iterable[str]) -> Tuple[List[str], List[str]]:
-        debug(f'Detecting slots from {detect_paths}, previous slots: {prev_slots}')
-        all_avaiable_paths = []
-        for path in detect_paths:
-            raw_paths = os.listdir(path)
-            real_paths = map(lambda p: os.path.join(path, p), raw_paths)
-            valid_paths = filter(lambda p: os.path.isdir(p) and not is_ignored_slot(p), real_paths)
-            all_avaiable_paths.extend(valid_paths)
-        
-        new_slot_paths = filter(lambda p: p not in prev_slots, all_avaiable_paths)
-        removal_slot_paths = filter(lambda p: p not in all_avaiable_paths, prev_slots)
-        debug(f'New slots: {new_slot_paths}, removal slots: {removal_slot_paths}')
-        return (list(set(new_slot_paths)), list(set(removal_slot_paths)))
+    def detect_slots(detect_paths: Iterable[str], prev_slots: Iterable[str],
+                     cache_file: Optional[str] = None) -> Tuple[List[str], List[str]]:
+        detect_paths = list(detect_paths)
+        debug('Detecting slots from %s', detect_paths)
+        cache = DetectHelper.load_cache(cache_file)
+        with ThreadPoolExecutor(max_workers=max(1, min(len(detect_paths), 8))) as pool:
+            results = list(pool.map(lambda p: scan_root(p, cache.get(p)), detect_paths))
+
+        all_available_paths = set()
+        for path, result in zip(detect_paths, results):
+            cache[path] = result
+            all_available_paths.update(os.path.join(path, name)
+                                       for name, (_, ignored) in result['children'].items() if not ignored)
+        DetectHelper.save_cache(cache_file, cache)
+
+        prev_slots = set(prev_slots)
+        new_slot_paths = sorted(all_available_paths - prev_slots)
+        removal_slot_paths = sorted(prev_slots - all_available_paths)
+        debug('New slots: %s, removal slots: %s', new_slot_paths, removal_slot_paths)
+        return new_slot_paths, removal_slot_paths
+
+    @staticmethod
+    def load_cache(cache_file: Optional[str]) -> Dict[str, dict]:
+        if cache_file is None:
+            return {}
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger().warning(f'Broken detect cache {cache_file}, ignored')
+            return {}
+
+    @staticmethod
+    def save_cache(cache_file: Optional[str], cache: Dict[str, dict]):
+        if cache_file is None:
+            return
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp = cache_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_file)
 
 
     @staticmethod
     def init_conf(path: str):
-        debug(f'Initializing mountable config for {path}')
+        debug('Initializing mountable config for %s', path)
         script_map = {
             'posix': './start.sh',
             'nt': 'start.bat'
         }
         default_script = script_map[os.name] if os.name in script_map else './start.sh'
         default_handler = 'vanilla_handler'
-        file_list = filter(lambda _: os.path.isfile(os.path.join(path, _)), os.listdir(path))
         conf = SlotConfig(checked=False, start_command=default_script, handler=default_handler)
-        for file in file_list:
-            if file[:5] == 'paper' and file[-4:] == '.jar':
-                conf.handler = 'bukkit_handler'
-                break
-        debug(f'saving mountable config: {conf}')
-        psi.save_config_simple(
-            config=conf,
-            file_name=os.path.join(path, MOUNTABLE_CONFIG),
-            in_data_folder=False)
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name[:5] == 'paper' and entry.name[-4:] == '.jar' and entry.is_file():
+                    conf.handler = 'bukkit_handler'
+                    break
+        debug('saving mountable config: %s', conf)
+        get_storage().save(path, conf)
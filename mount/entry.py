@@ -2,63 +2,81 @@ from typing import Optional
 
 from mcdreforged.api.types import Info, PluginServerInterface
 
+from . import metrics
 from .cmd_tree import register_commands
 from .config import MountConfig
 from .constants import CONFIG_NAME
 from .MountManager import MountManager
-from .utils import debug, rtr
+from .scheduler import scheduler
+from .storage import get_storage
+from .utils import debug, rtr, setTrace
 
 manager: Optional[MountManager] = None
 
 
 def on_load(server: PluginServerInterface, prev_module):
-    debug(f"plugin loaded")
+    debug("plugin loaded")
     global manager
     config: MountConfig = MountConfig.load()
     manager = MountManager(config=config)
     register_commands(server, manager)
+    manager.start_watcher()
+    manager.start_heartbeat()
+    manager.seed_players()
+    manager.start_queue()
+    manager.start_idle_check()
 
     if manager.current_slot and server.is_server_running():
         manager.current_slot.on_mount()
 
 
 def on_unload(server: PluginServerInterface):
-    debug(f"plugin unloaded")
+    debug("plugin unloaded")
     if not manager:
         return
+    manager.stop_watcher()
     if manager.current_slot and server.is_server_running():
         manager.current_slot.on_unmount()
+    scheduler.stop()
+    get_storage().close()
+    setTrace(None)
 
 
 def on_server_startup(server: PluginServerInterface):
-    debug(f"server started")
+    debug("server started")
     if not manager:
         return
+    metrics.on_server_startup(manager.get_config('metrics_history'))
+    manager.reset_players()
     if manager.current_slot:
         manager.current_slot.on_mount()
+        manager.maintain_worlds()
 
 
 def on_server_stop(server: PluginServerInterface, code: int):
-    debug(f"server stopped, code: {code}")
+    debug("server stopped, code: %s", code)
     if not manager:
         return
     if manager.current_slot:
         manager.current_slot.on_unmount()
+    manager.reset_players()
 
 
 def on_player_joined(server: PluginServerInterface, player: str, info: Info):
-    debug(f"player joined: {player}")
+    debug("player joined: %s", player)
     if not manager:
         return
     if manager._config.welcome_player:
         server.tell(player, rtr('help_msg.welcome'))
+    manager.track_player(player, True)
     if manager.current_slot:
         manager.current_slot.on_player_join(player)
 
 
 def on_player_left(server: PluginServerInterface, player: str):
-    debug(f"player left: {player}")
+    debug("player left: %s", player)
     if not manager:
         return
+    manager.track_player(player, False)
     if manager.current_slot:
         manager.current_slot.on_player_left(player)
@@ -0,0 +1,127 @@
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from .constants import LEASE_FILE
+from .utils import debug, logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# how long to wait for another instance holding the guard of a lease file
+GUARD_TIMEOUT = 5
+
+
+@contextmanager
+def _guard(path: str):
+    """
+    Serialize read-modify-write of the lease file across processes, with flock if available,
+    or an exclusively created guard file otherwise, a guard file left by a crash expires after GUARD_TIMEOUT
+    """
+    guard_file = path + '.lock'
+    deadline = time.time() + GUARD_TIMEOUT
+    if fcntl is not None:
+        fd = os.open(guard_file, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() > deadline:
+                        raise TimeoutError(f'Timed out waiting for {guard_file}')
+                    time.sleep(0.05)
+            yield
+        finally:
+            # the lock is released with the fd, also when the process dies
+            os.close(fd)
+        return
+    while True:
+        try:
+            os.close(os.open(guard_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(guard_file).st_mtime > GUARD_TIMEOUT:
+                    os.remove(guard_file)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f'Timed out waiting for {guard_file}')
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(guard_file)
+
+
+class Lease:
+    """
+    Lease of a slot held by a mcdr instance, kept alive by heartbeats.
+    A lease without heartbeat for ttl seconds is expired and can be taken by others
+    """
+    def __init__(self, slot_path: str, ttl: int = 60):
+        self.path = os.path.join(slot_path, LEASE_FILE)
+        self.ttl = ttl
+
+    def read(self) -> Optional[dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger().warning(f'Broken lease {self.path}, treated as expired')
+            return None
+
+    def owner(self) -> str:
+        """
+        :return: owner of the lease, empty if free or expired
+        """
+        lease = self.read()
+        if lease is None or time.time() - lease.get('heartbeat', 0) > self.ttl:
+            return ''
+        return lease.get('owner', '')
+
+    def _write(self, owner: str):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'owner': owner, 'heartbeat': time.time(), 'host': socket.gethostname(), 'pid': os.getpid()}, f)
+        os.replace(tmp, self.path)
+
+    def acquire(self, owner: str) -> bool:
+        """
+        Take the lease if it is free, expired or held by owner already
+        """
+        with _guard(self.path):
+            current = self.owner()
+            if current not in ['', owner]:
+                return False
+            if current == '' and self.read() is not None:
+                logger().info(f'Reclaiming expired lease {self.path} of {self.read().get("owner")}')
+            self._write(owner)
+            return True
+
+    def heartbeat(self, owner: str) -> bool:
+        """
+        :return: False if the lease is lost, e.g. expired and taken by others
+        """
+        with _guard(self.path):
+            lease = self.read()
+            if lease is None or lease.get('owner') != owner:
+                return False
+            self._write(owner)
+            return True
+
+    def release(self, owner: str):
+        with _guard(self.path):
+            lease = self.read()
+            if lease is not None and lease.get('owner') == owner:
+                debug('Releasing lease %s', self.path)
+                os.remove(self.path)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .constants import MANIFEST_NAME
+from .utils import debug, logger
+
+# size, mtime_ns
+FileStat = Tuple[int, int]
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def to_path(root: str, rel: str) -> str:
+    return os.path.join(root, *rel.split('/'))
+
+
+def scan_tree(root: str, rel_dirs: Iterable[str]) -> Tuple[Dict[str, FileStat], Set[str]]:
+    """
+    Walk the given dirs under root
+    :return: stats of the files and the set of dirs, both keyed by '/' separated relative path
+    """
+    files: Dict[str, FileStat] = {}
+    dirs: Set[str] = set()
+
+    def walk(rel: str):
+        dirs.add(rel)
+        with os.scandir(to_path(root, rel)) as it:
+            for entry in it:
+                child = f'{rel}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    walk(child)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    files[child] = (st.st_size, st.st_mtime_ns)
+
+    for rel_dir in rel_dirs:
+        if os.path.isdir(to_path(root, rel_dir)):
+            walk(rel_dir)
+    return files, dirs
+
+
+def readahead(root: str, rel_dirs: Iterable[str], limit: int = 0) -> int:
+    """
+    Ask the kernel to load the files into page cache in background, does nothing without posix_fadvise
+    :param limit: stop after this many bytes, 0 for no limit
+    :return: bytes hinted
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return 0
+    hinted = 0
+    files, _ = scan_tree(root, rel_dirs)
+    for rel, (size, _) in files.items():
+        if 0 < limit < hinted + size:
+            break
+        try:
+            fd = os.open(to_path(root, rel), os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            hinted += size
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    return hinted
+
+
+class Manifest:
+    """
+    Size, mtime and content hash of every file in a reset template,
+    stored as MANIFEST_NAME under the template dir
+    """
+    def __init__(self, root: str):
+        self.root = root
+        # rel path -> [size, mtime_ns, hash]
+        self.files: Dict[str, List] = {}
+        self.dirs: Set[str] = set()
+
+    @property
+    def file_path(self):
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    @staticmethod
+    def load(root: str) -> 'Manifest':
+        manifest = Manifest(root)
+        try:
+            with open(manifest.file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            manifest.files = data.get('files', {})
+            manifest.dirs = set(data.get('dirs', []))
+        except FileNotFoundError:
+            debug('No manifest in %s, will build a new one', root)
+        except (ValueError, AttributeError):
+            logger().warning(f'Broken manifest in {root}, will build a new one')
+        return manifest
+
+    def save(self):
+        tmp = self.file_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'dirs': sorted(self.dirs)}, f)
+        os.replace(tmp, self.file_path)
+
+    def update(self, rel_dirs: Iterable[str]) -> bool:
+        """
+        Rescan the template, only files whose size or mtime changed get hashed again
+        :return: True if anything changed
+        """
+        files, dirs = scan_tree(self.root, rel_dirs)
+        changed = dirs != self.dirs or files.keys() != self.files.keys()
+        new_files = {}
+        for rel, (size, mtime_ns) in files.items():
+            prev = self.files.get(rel)
+            if prev is not None and prev[0] == size and prev[1] == mtime_ns:
+                new_files[rel] = prev
+            else:
+                changed = True
+                new_files[rel] = [size, mtime_ns, hash_file(to_path(self.root, rel))]
+        self.files, self.dirs = new_files, dirs
+        return changed
+
+    def matches(self, rel: str, path: str, stat: FileStat) -> bool:
+        """
+        Check if the live file at path is the same as the template file rel
+        """
+        size, mtime_ns, digest = self.files[rel]
+        if stat[0] != size:
+            return False
+        if stat[1] == mtime_ns:
+            return True
+        # same size but touched, compare the content
+        if hash_file(path) != digest:
+            return False
+        # sync the mtime, so the quick check passes next time
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        return True
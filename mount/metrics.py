@@ -0,0 +1,214 @@
+import functools
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from .constants import METRICS_EXPORT, METRICS_FILE, METRICS_PENDING
+from .utils import debug, logger, psi
+
+# an operation waiting for the server longer than this is considered failed
+PENDING_TIMEOUT = 3600
+QUANTILES = [0.5, 0.95]
+
+
+class OperationRun:
+    """
+    Phase durations of one mount, reset or rollback, in seconds.
+    Phases may overlap or nest, e.g. prepare runs during countdown, so they are only a breakdown of the total
+    """
+    def __init__(self, op: str, slot: str, started: Optional[float] = None, phases: Optional[Dict[str, float]] = None):
+        self.op = op
+        self.slot = slot
+        self.started = time.time() if started is None else started
+        self.phases: Dict[str, float] = {} if phases is None else phases
+        # wall clock time from begin() to the server started, set by finish()
+        self.total = 0.0
+        # when psi.start is called, the ready phase lasts until the server is started
+        self.ready_since = 0.0
+        self._lock = Lock()
+
+    def add(self, phase_name: str, seconds: float):
+        with self._lock:
+            self.phases[phase_name] = self.phases.get(phase_name, 0) + seconds
+
+    def serialize(self) -> dict:
+        with self._lock:
+            return {'op': self.op, 'slot': self.slot, 'started': self.started,
+                    'phases': dict(self.phases), 'ready_since': self.ready_since}
+
+    def finish(self):
+        self.total = time.time() - self.started
+
+
+_current: Optional[OperationRun] = None
+_history_lock = Lock()
+
+
+def begin(op: str, slot: str) -> OperationRun:
+    global _current
+    _current = OperationRun(op, slot)
+    return _current
+
+
+def discard():
+    """
+    Drop the running operation, it is cancelled
+    """
+    global _current
+    _current = None
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Time the block as a phase of the running operation, does nothing if no operation is running
+    """
+    run = _current
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if run is not None:
+            run.add(name, time.monotonic() - start)
+
+
+def timed(name: str):
+    """
+    Time the decorated function as a phase of the running operation
+    """
+    def wrapper(func: Callable):
+        @functools.wraps(func)
+        def wrap(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrap
+    return wrapper
+
+
+def _data_file(name: str) -> str:
+    return os.path.join(psi.get_data_folder(), name)
+
+
+def _dump(name: str, data):
+    path = _data_file(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(data if isinstance(data, str) else json.dumps(data))
+    os.replace(path + '.tmp', path)
+
+
+def wait_ready():
+    """
+    Called right after psi.start, the running operation is finished once the server is started.
+    It is saved to the data folder, since the plugin may be reloaded before that
+    """
+    global _current
+    run, _current = _current, None
+    if run is None:
+        return
+    run.ready_since = time.time()
+    try:
+        _dump(METRICS_PENDING, run.serialize())
+    except OSError as e:
+        logger().error(f'Failed to save pending metrics: {e}')
+
+
+def on_server_startup(history_size: int):
+    """
+    Finish the pending operation with the ready phase, then record it
+    """
+    try:
+        with open(_data_file(METRICS_PENDING), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        os.remove(_data_file(METRICS_PENDING))
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger().warning(f'Broken pending metrics, ignored: {e}')
+        return
+    ready = time.time() - data['ready_since']
+    if ready > PENDING_TIMEOUT:
+        debug('Pending %s of %s timed out, dropped', data['op'], data['slot'])
+        return
+    run = OperationRun(data['op'], data['slot'], data['started'], data['phases'])
+    run.add('ready', ready)
+    run.finish()
+    record(run, history_size)
+
+
+def load_history() -> Dict[str, List[dict]]:
+    """
+    :return: runs by slot path, oldest first
+    """
+    try:
+        with open(_data_file(METRICS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger().warning(f'Broken metrics history {METRICS_FILE}, starting a new one')
+        return {}
+
+
+def record(run: OperationRun, history_size: int):
+    debug('%s of %s took %ss: %s', run.op, run.slot, round(run.total, 2), run.phases)
+    with _history_lock:
+        history = load_history()
+        runs = history.setdefault(run.slot, [])
+        runs.append({'op': run.op, 'started': run.started, 'total': run.total, 'phases': run.phases})
+        del runs[:max(len(runs) - history_size, 0)]
+        try:
+            _dump(METRICS_FILE, history)
+            _dump(METRICS_EXPORT, export_prometheus(history))
+        except OSError as e:
+            logger().error(f'Failed to save metrics: {e}')
+
+
+def quantile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank quantile
+    """
+    values = sorted(values)
+    return values[max(math.ceil(q * len(values)) - 1, 0)] if len(values) > 0 else 0
+
+
+def summarize(runs: List[dict]) -> Dict[str, Dict[str, List[float]]]:
+    """
+    :return: durations of every phase by operation, the wall clock time of the whole operation is named total
+    """
+    result: Dict[str, Dict[str, List[float]]] = {}
+    for run in runs:
+        # runs recorded before the wall clock total was kept, summing their overlapping phases is wrong
+        if 'total' not in run:
+            continue
+        phases = result.setdefault(run['op'], {})
+        for name, seconds in run['phases'].items():
+            phases.setdefault(name, []).append(seconds)
+        phases.setdefault('total', []).append(run['total'])
+    return result
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def export_prometheus(history: Dict[str, List[dict]]) -> str:
+    lines = ['# HELP mount_phase_seconds Time spent in each phase of mount operations, phases may overlap, '
+             'phase total for the wall clock time of the whole',
+             '# TYPE mount_phase_seconds summary']
+    last_lines = ['# HELP mount_phase_last_seconds Time spent in each phase by the last operation',
+                  '# TYPE mount_phase_last_seconds gauge']
+    for slot, runs in sorted(history.items()):
+        for op, phases in sorted(summarize(runs).items()):
+            for name, values in sorted(phases.items()):
+                labels = f'slot="{_label(slot)}",op="{_label(op)}",phase="{_label(name)}"'
+                for q in QUANTILES:
+                    lines.append(f'mount_phase_seconds{{{labels},quantile="{q}"}} {quantile(values, q):.3f}')
+                lines.append(f'mount_phase_seconds_sum{{{labels}}} {sum(values):.3f}')
+                lines.append(f'mount_phase_seconds_count{{{labels}}} {len(values)}')
+                last_lines.append(f'mount_phase_last_seconds{{{labels}}} {values[-1]:.3f}')
+    return '\n'.join(lines + last_lines) + '\n'
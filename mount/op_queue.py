@@ -0,0 +1,124 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import List, Optional
+
+from .utils import debug, logger
+
+QUEUE_OPS = ['mount', 'reset']
+# at: at the given time, empty: once no player is online, next: right after the operations before it
+QUEUE_TRIGGERS = ['at', 'empty', 'next']
+
+
+class QueuedOp:
+    __slots__ = ('id', 'op', 'path', 'trigger', 'at', 'created')
+
+    def __init__(self, id: int, op: str, path: str, trigger: str, at: float = 0.0, created: Optional[float] = None):
+        self.id = id
+        self.op = op
+        # slot to mount, empty for reset which applies to the slot mounted when it runs
+        self.path = path
+        self.trigger = trigger
+        self.at = at
+        self.created = time.time() if created is None else created
+
+    def serialize(self) -> dict:
+        return {i: getattr(self, i) for i in self.__slots__}
+
+    def is_due(self, now: float, empty: bool) -> bool:
+        if self.trigger == 'at':
+            return now >= self.at
+        if self.trigger == 'empty':
+            return empty
+        return True
+
+
+def parse_time(text: str, now: Optional[datetime] = None) -> Optional[float]:
+    """
+    :param text: HH:MM for the next time of the day, or YYYY-MM-DDTHH:MM
+    :return: the timestamp, None if invalid
+    """
+    now = datetime.now() if now is None else now
+    try:
+        return datetime.strptime(text, '%Y-%m-%dT%H:%M').timestamp()
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(text, '%H:%M')
+    except ValueError:
+        return None
+    target = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return target.timestamp()
+
+
+class OpQueue:
+    """
+    Operations waiting to run one by one in order, kept in a file so they survive restarts and plugin reloads.
+    Only the head is checked, so an operation waits for the ones queued before it
+    """
+    def __init__(self, file: str):
+        self.file = file
+        self._lock = Lock()
+        self._ops: List[QueuedOp] = []
+        self._next_id = 1
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            ops = [QueuedOp(**i) for i in data['ops']]
+            next_id = data['next_id']
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            logger().warning(f'Broken operation queue {self.file}, starting a new one: {e}')
+            return
+        with self._lock:
+            self._ops, self._next_id = ops, next_id
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'next_id': self._next_id, 'ops': [i.serialize() for i in self._ops]}, f)
+        os.replace(self.file + '.tmp', self.file)
+
+    def add(self, op: str, path: str, trigger: str, at: float = 0.0) -> QueuedOp:
+        with self._lock:
+            queued = QueuedOp(self._next_id, op, path, trigger, at)
+            self._next_id += 1
+            self._ops.append(queued)
+            self._save()
+        debug('Queued %s', queued.serialize())
+        return queued
+
+    def remove(self, op_id: Optional[int] = None) -> int:
+        """
+        :param op_id: None for all
+        :return: number of removed operations
+        """
+        with self._lock:
+            kept = [] if op_id is None else [i for i in self._ops if i.id != op_id]
+            removed, self._ops = len(self._ops) - len(kept), kept
+            if removed > 0:
+                self._save()
+        return removed
+
+    def pop_due(self, empty: bool) -> Optional[QueuedOp]:
+        """
+        Take the head if it is due, it is removed before running, so a crash won't run it twice
+        """
+        with self._lock:
+            if len(self._ops) == 0 or not self._ops[0].is_due(time.time(), empty):
+                return None
+            head = self._ops.pop(0)
+            self._save()
+        return head
+
+    def list(self) -> List[QueuedOp]:
+        with self._lock:
+            return list(self._ops)
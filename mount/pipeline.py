@@ -0,0 +1,143 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .utils import debug, logger, span
+
+
+class PipelineError(Exception):
+    """
+    A step failed or timed out, the finished steps are undone already
+    """
+    def __init__(self, step: str, cause: BaseException):
+        super().__init__(f'{step}: {cause!r}')
+        self.step = step
+        self.cause = cause
+
+
+class PipelineStuckError(PipelineError):
+    """
+    A timed out step is still running after another timeout, the other done steps are undone,
+    the stuck ones are left as they are since undoing them would race with them
+    """
+    def __init__(self, step: str, cause: BaseException, stuck: List[str]):
+        super().__init__(step, cause)
+        self.stuck = stuck
+
+
+class Step:
+    __slots__ = ('name', 'do', 'undo', 'after', 'timeout')
+
+    def __init__(self, name: str, do: Callable[[], Any], undo: Optional[Callable[[], None]],
+                 after: Iterable[str], timeout: float):
+        self.name = name
+        self.do = do
+        self.undo = undo
+        self.after = list(after)
+        self.timeout = timeout
+
+
+class Pipeline:
+    """
+    Steps run as soon as the steps they depend on are done, independent ones in parallel.
+    run() returns after every step is done, or raises PipelineError after undoing the done steps
+    in reverse order of completion, a timed out step is undone too since it may be partially applied.
+    A step is only undone after it returns, if it doesn't within twice its timeout PipelineStuckError is raised
+    """
+    def __init__(self, name: str, workers: int = 4):
+        self.name = name
+        self.workers = workers
+        self.steps: Dict[str, Step] = {}
+
+    def add(self, name: str, do: Callable[[], Any], undo: Optional[Callable[[], None]] = None,
+            after: Iterable[str] = (), timeout: float = 30) -> 'Pipeline':
+        self.steps[name] = Step(name, do, undo, after, timeout)
+        return self
+
+    def _check(self):
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Dependency cycle at step {name} of {self.name}')
+            visiting.add(name)
+            for dep in self.steps[name].after:
+                if dep not in self.steps:
+                    raise ValueError(f'Unknown step {dep} required by {name} of {self.name}')
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for i in self.steps:
+            visit(i)
+
+    def _run_step(self, step: Step):
+        with span('pipeline_step', pipeline=self.name, step=step.name):
+            return step.do()
+
+    def run(self) -> Dict[str, Any]:
+        """
+        :return: results of the steps by name
+        """
+        self._check()
+        results: Dict[str, Any] = {}
+        done: List[str] = []
+        running: Dict[Future, Step] = {}
+        deadlines: Dict[Future, float] = {}
+        pending = dict(self.steps)
+        failed: Optional[PipelineError] = None
+        stuck: List[str] = []
+        pool = ThreadPoolExecutor(max_workers=max(self.workers, 1), thread_name_prefix=f'{self.name}-step')
+        try:
+            while failed is None and (len(pending) > 0 or len(running) > 0):
+                for step in [i for i in pending.values() if all(dep in results for dep in i.after)]:
+                    debug('Starting step %s of %s', step.name, self.name)
+                    del pending[step.name]
+                    future = pool.submit(self._run_step, step)
+                    running[future] = step
+                    deadlines[future] = time.monotonic() + step.timeout
+                finished, _ = wait(running, timeout=max(min(deadlines.values()) - time.monotonic(), 0),
+                                   return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    del deadlines[future]
+                    try:
+                        results[step.name] = future.result()
+                        done.append(step.name)
+                    except Exception as e:
+                        failed = failed or PipelineError(step.name, e)
+                for future, deadline in deadlines.items():
+                    if future not in finished and time.monotonic() >= deadline and failed is None:
+                        step = running[future]
+                        failed = PipelineError(step.name, TimeoutError(f'timed out after {step.timeout}s'))
+            if failed is not None:
+                # a started step can't be cancelled, let the running ones, the timed out one included, return
+                # before undoing them, or the undo would race with the step
+                for future, step in running.items():
+                    wait([future], timeout=max(deadlines[future] + step.timeout - time.monotonic(), 0))
+                    if future.done():
+                        done.append(step.name)
+                    else:
+                        stuck.append(step.name)
+                self._undo(done)
+                if len(stuck) > 0:
+                    logger().error(f'Steps {stuck} of {self.name} are still running, left as they are')
+                    raise PipelineStuckError(failed.step, failed.cause, stuck)
+                raise failed
+        finally:
+            # a stuck step may never return, joining it would hang the caller instead of reporting it
+            pool.shutdown(wait=len(stuck) == 0)
+        return results
+
+    def _undo(self, done: List[str]):
+        for name in reversed(done):
+            step = self.steps[name]
+            if step.undo is None:
+                continue
+            debug('Undoing step %s of %s', name, self.name)
+            try:
+                step.undo()
+            except Exception as e:
+                logger().exception(f'Failed to undo step {name} of {self.name}: {e}')
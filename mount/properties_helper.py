@@ -0,0 +1,122 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from jproperties import Properties
+
+from .utils import debug, logger
+
+PATCH_WORKERS = 8
+# values of these keys are masked in diff summaries, e.g. rcon.password
+SECRET_KEYS = ['password', 'secret', 'token']
+
+
+class PatchResult(NamedTuple):
+    path: str
+    # key -> (old value, None if missing, new value)
+    diff: Dict[str, Tuple[Optional[str], str]]
+    written: bool
+    error: Optional[str] = None
+
+
+def is_secret(key: str) -> bool:
+    return any(i in key.lower() for i in SECRET_KEYS)
+
+
+class PropertiesHelper:
+    """
+    Patch server.properties of slots by the overwrite file, only the files with changed values are written
+    """
+    _overwrite_lock = Lock()
+    # overwrite file -> ((mtime_ns, size), patches)
+    _overwrite_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+
+    @staticmethod
+    def load_overwrite(overwrite_path: str) -> Optional[Dict[str, str]]:
+        """
+        Parse the overwrite file, parsed again only if it is changed
+        :return: the properties to patch, None if the file doesn't exist
+        """
+        try:
+            st = os.stat(overwrite_path)
+        except FileNotFoundError:
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        with PropertiesHelper._overwrite_lock:
+            cached = PropertiesHelper._overwrite_cache.get(overwrite_path)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        debug('Parsing overwrite file %s', overwrite_path)
+        patches = Properties()
+        with open(overwrite_path, 'rb') as f:
+            patches.load(f, 'utf-8')
+        result = dict(patches.properties)
+        with PropertiesHelper._overwrite_lock:
+            PropertiesHelper._overwrite_cache[overwrite_path] = (key, result)
+        return result
+
+    @staticmethod
+    def patch(server_path: str, patches: Dict[str, str],
+              create: bool = True) -> Tuple[Optional[bytes], Dict[str, Tuple[Optional[str], str]]]:
+        """
+        :param create: patch a missing server.properties as an empty one, otherwise raise FileNotFoundError
+        :return: the patched content, None if nothing changes, and the changed values
+        """
+        properties = Properties()
+        try:
+            with open(os.path.join(server_path, 'server.properties'), 'rb') as f:
+                properties.load(f, 'utf-8')
+        except FileNotFoundError:
+            if not create:
+                raise
+            logger().error(f'No properties file for slot {server_path}!')
+        current = properties.properties
+        diff = {k: (current.get(k), v) for k, v in patches.items() if current.get(k) != v}
+        if len(diff) == 0:
+            return None, diff
+        for k, (_, v) in diff.items():
+            properties[k] = v
+        buf = io.BytesIO()
+        properties.store(buf, encoding='utf-8')
+        return buf.getvalue(), diff
+
+    @staticmethod
+    def write(server_path: str, content: bytes):
+        """
+        Replace server.properties atomically, a crash won't leave a truncated one
+        """
+        debug('Saving properties for slot %s...', server_path)
+        file_name = os.path.join(server_path, 'server.properties')
+        # unique per process and thread, instances sharing the pool and a --patch-all may write the same slot at once
+        tmp = f'{file_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, file_name)
+
+    @staticmethod
+    def patch_file(server_path: str, patches: Dict[str, str], dry_run: bool = False) -> PatchResult:
+        try:
+            content, diff = PropertiesHelper.patch(server_path, patches, create=False)
+            if content is not None and not dry_run:
+                PropertiesHelper.write(server_path, content)
+        except FileNotFoundError:
+            return PatchResult(server_path, {}, False, 'server.properties not found')
+        except (OSError, ValueError) as e:
+            logger().error(f'Failed to patch properties of {server_path}: {e}')
+            return PatchResult(server_path, {}, False, str(e))
+        return PatchResult(server_path, diff, content is not None and not dry_run)
+
+    @staticmethod
+    def patch_all(server_paths: Iterable[str], patches: Dict[str, str], dry_run: bool = False,
+                  workers: int = PATCH_WORKERS) -> List[PatchResult]:
+        """
+        Patch the slots in parallel, slots without server.properties are left untouched and reported as failed
+        :return: result of every slot, in the given order
+        """
+        server_paths = list(server_paths)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(server_paths))),
+                                thread_name_prefix='mount-patch') as pool:
+            return list(pool.map(lambda p: PropertiesHelper.patch_file(p, patches, dry_run), server_paths))
@@ -0,0 +1,104 @@
+import os
+import struct
+from typing import Dict, List, Tuple
+
+from .constants import WORLDS
+from .utils import debug, logger
+
+SECTOR_SIZE = 4096
+# location table and timestamp table
+HEADER_SIZE = 2 * SECTOR_SIZE
+CHUNKS = 1024
+
+
+class RegionError(Exception):
+    pass
+
+
+def read_chunks(data: bytes) -> Tuple[Dict[int, bytes], List[int]]:
+    """
+    Parse an anvil region file
+    :return: raw payload(length, compression type and data) of every chunk by index, and the timestamps
+    """
+    if len(data) == 0:
+        return {}, [0] * CHUNKS
+    if len(data) < HEADER_SIZE:
+        raise RegionError('truncated header')
+    locations = struct.unpack_from('>1024I', data, 0)
+    timestamps = list(struct.unpack_from('>1024I', data, SECTOR_SIZE))
+    chunks = {}
+    for i, loc in enumerate(locations):
+        offset, count = loc >> 8, loc & 0xFF
+        if offset == 0 and count == 0:
+            continue
+        start = offset * SECTOR_SIZE
+        if offset < 2 or start + 5 > len(data):
+            raise RegionError(f'chunk {i} out of file')
+        length = struct.unpack_from('>I', data, start)[0]
+        # chunks bigger than 255 sectors are saved in external .mcc file, count is capped
+        if length == 0 or start + 4 + length > len(data) or (count < 255 and 4 + length > count * SECTOR_SIZE):
+            raise RegionError(f'chunk {i} has invalid length {length}')
+        chunks[i] = data[start: start + 4 + length]
+    return chunks, timestamps
+
+
+def pack_chunks(chunks: Dict[int, bytes], timestamps: List[int]) -> bytes:
+    locations = [0] * CHUNKS
+    body = bytearray()
+    sector = HEADER_SIZE // SECTOR_SIZE
+    for i in sorted(chunks):
+        payload = chunks[i]
+        count = (len(payload) + SECTOR_SIZE - 1) // SECTOR_SIZE
+        locations[i] = (sector << 8) | min(count, 255)
+        body += payload
+        body += bytes(count * SECTOR_SIZE - len(payload))
+        sector += count
+    return struct.pack('>1024I', *locations) + struct.pack('>1024I', *timestamps) + bytes(body)
+
+
+class RegionHelper:
+    @staticmethod
+    def compact_file(path: str) -> Tuple[int, int]:
+        """
+        Rewrite a region file densely packed, without free sectors and stale chunk data
+        :return: size before and after
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        chunks, timestamps = read_chunks(data)
+        packed = pack_chunks(chunks, timestamps)
+        if len(packed) >= len(data):
+            return len(data), len(data)
+        # verify the tables before replacing the file
+        new_chunks, new_timestamps = read_chunks(packed)
+        if new_chunks != chunks or new_timestamps != timestamps:
+            raise RegionError('chunk table mismatch after compacting')
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(packed)
+        os.replace(tmp, path)
+        return len(data), len(packed)
+
+    @staticmethod
+    def compact(template: str) -> Tuple[int, int, List[str]]:
+        """
+        Compact all region files in world dirs under template
+        :return: files compacted, bytes saved and files failed
+        """
+        compacted, saved, failed = 0, 0, []
+        for world in WORLDS:
+            for root, _, files in os.walk(os.path.join(template, world)):
+                for file in filter(lambda x: x.endswith('.mca'), files):
+                    path = os.path.join(root, file)
+                    try:
+                        before, after = RegionHelper.compact_file(path)
+                    except (OSError, RegionError) as e:
+                        logger().error(f'Failed to compact {path}: {e}')
+                        failed.append(path)
+                        continue
+                    if after < before:
+                        debug('Compacted %s: %s -> %s', path, before, after)
+                        compacted += 1
+                        saved += before - after
+        logger().info(f'Compacted {compacted} region files in {template}, {saved} bytes saved')
+        return compacted, saved, failed
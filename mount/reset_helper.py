@@ -1,58 +1,311 @@
+import multiprocessing
 import os
 import shutil
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing.context import BaseContext
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
+from .archive_helper import ArchiveHelper
+from .constants import RESERVE_DIRS, WORLDS
+from .manifest import Manifest, scan_tree, to_path
+from .reset_worker import clone_file, delete_file
 from .utils import logger
 
+RESET_MODES = ['copy', 'reflink']
+RESET_EXECUTORS = ['thread', 'process']
+
+
+def process_context() -> Optional[BaseContext]:
+    """
+    Process workers are forked, a spawned one would import the plugin outside MCDR
+    :return: None if fork is not available, e.g. on windows
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork')
+
+
+class ResetProgress:
+    def __init__(self):
+        self.phase = 'delete'
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_done = 0
+        self.bytes_total = 0
+
+    def __str__(self):
+        return f'{self.phase}: {self.files_done}/{self.files_total} files, ' \
+               f'{self.bytes_done}/{self.bytes_total} bytes'
+
+
+class IncrementalDiff(NamedTuple):
+    manifest: Manifest
+    # live dirs and files missing in the template, deleted by reset, a deleted dir covers its content
+    deleted_dirs: List[str]
+    deleted_files: List[str]
+    # live files different from the template, overwritten by reset
+    changed: List[str]
+    # template files and dirs missing in the live worlds, restored by reset
+    missing: List[str]
+    missing_dirs: List[str]
+    unchanged: List[str]
+    kept_dirs: List[str]
+
+
+class ResetEngine:
+    """
+    Collect file level delete and copy operations, then fan them out to a worker pool,
+    so a single huge dimension won't serialize the whole reset
+    """
+    def __init__(self, mode: str = 'copy', workers: int = 1, executor: str = 'thread',
+                 progress: Optional[Callable[[ResetProgress], None]] = None, progress_interval: float = 1):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.executor = executor
+        self.used: Dict[str, int] = {}
+        self._progress_cb = progress
+        self._progress_interval = progress_interval
+        self._last_report = 0.0
+        self._delete_files: List[str] = []
+        self._delete_dirs: List[str] = []
+        self._copy_files: List[Tuple[str, str]] = []
+        self._copy_dirs: List[Tuple[str, str]] = []
+
+    def delete(self, path: str):
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, files in os.walk(path):
+                self._delete_dirs.append(root)
+                self._delete_files.extend(os.path.join(root, f) for f in files)
+                # links to dirs are removed as files, never followed
+                self._delete_files.extend(os.path.join(root, d) for d in dirs
+                                          if os.path.islink(os.path.join(root, d)))
+        elif os.path.lexists(path):
+            self._delete_files.append(path)
+
+    def copy(self, src: str, dst: str):
+        if os.path.isdir(src):
+            for root, dirs, files in os.walk(src):
+                target = os.path.join(dst, os.path.relpath(root, src))
+                self._copy_dirs.append((root, os.path.normpath(target)))
+                self._copy_files.extend((os.path.join(root, f), os.path.join(target, f)) for f in files)
+        else:
+            self._copy_files.append((src, dst))
+
+    def mkdir(self, src: str, dst: str):
+        """
+        Create dst as a copy of the dir src, without its content
+        """
+        self._copy_dirs.append((src, dst))
+
+    def _new_executor(self) -> Executor:
+        if self.executor == 'process':
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context())
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='mount-reset')
+
+    def _report(self, progress: ResetProgress, force: bool = False):
+        if self._progress_cb is None:
+            return
+        now = time.time()
+        if force or now - self._last_report >= self._progress_interval:
+            self._last_report = now
+            self._progress_cb(progress)
+
+    def run(self):
+        progress = ResetProgress()
+        with self._new_executor() as pool:
+            # delete phase, files first, then the empty dirs from the deepest one
+            progress.files_total = len(self._delete_files)
+            futures = [pool.submit(delete_file, f) for f in self._delete_files]
+            for future in as_completed(futures):
+                progress.files_done += 1
+                progress.bytes_done += future.result()
+                self._report(progress)
+            for d in sorted(self._delete_dirs, key=len, reverse=True):
+                os.rmdir(d)
+            self._report(progress, force=True)
+
+            # copy phase, create dirs first so the files can be copied in any order
+            progress = ResetProgress()
+            progress.phase = 'copy'
+            targets = set(target for _, target in self._copy_dirs)
+            targets.update(os.path.dirname(dst) for _, dst in self._copy_files)
+            for target in targets:
+                os.makedirs(target, exist_ok=True)
+            progress.files_total = len(self._copy_files)
+            progress.bytes_total = sum(os.path.getsize(src) for src, _ in self._copy_files)
+            futures = [pool.submit(clone_file, src, dst, self.mode) for src, dst in self._copy_files]
+            for future in as_completed(futures):
+                strategy, size = future.result()
+                self.used[strategy] = self.used.get(strategy, 0) + 1
+                progress.files_done += 1
+                progress.bytes_done += size
+                self._report(progress)
+            for src, target in self._copy_dirs:
+                shutil.copystat(src, target)
+            self._report(progress, force=True)
+
+    def summary(self) -> str:
+        if len(self.used) == 0:
+            return 'nothing copied'
+        return ', '.join(f'{k} x{v}' for k, v in self.used.items())
+
 
 class ResetHelper:
     @staticmethod
-    def reset(slot_path, reset_path, reset_type):
-        reserve_dirs = ['playerdata', 'advancements', 'stats']
-        worlds = ['world', 'world_nether', 'world_the_end']
-        reset_worlds = filter(lambda x: os.path.isdir(x),
-            map(lambda x: os.path.join(slot_path, reset_path, x), worlds))
-        curr_worlds = filter(lambda x: os.path.isdir(x),
-            map(lambda x: os.path.join(slot_path, x), worlds))
+    def reset(slot_path, reset_path, reset_type, reset_mode='copy', incremental: bool = False,
+              workers: int = 1, executor: str = 'thread',
+              progress: Optional[Callable[[ResetProgress], None]] = None, diff: Optional[IncrementalDiff] = None):
+        """
+        :param diff: for incremental reset, computed already by a partial snapshot
+        """
+        if reset_mode not in RESET_MODES:
+            logger().warning(f'Unknown reset mode {reset_mode}, fallback to copy')
+            reset_mode = 'copy'
+        if executor not in RESET_EXECUTORS:
+            logger().warning(f'Unknown reset executor {executor}, fallback to thread')
+            executor = 'thread'
+        if executor == 'process' and process_context() is None:
+            logger().warning('Process reset executor needs fork, which is not available here, fallback to thread')
+            executor = 'thread'
+        engine = ResetEngine(reset_mode, workers, executor, progress)
+        logger().info(f'Resetting with mode {reset_mode}, {workers} {executor} worker(s)...')
+        template = os.path.join(slot_path, reset_path)
+        if ArchiveHelper.is_archive(template):
+            if incremental:
+                logger().info('Incremental reset is not supported by archive, extracting the whole archive')
+            ResetHelper._plan_delete(engine, slot_path, reset_type)
+            engine.run()
+            files, size = ArchiveHelper.extract(template, slot_path, reset_type)
+            logger().info(f'Reset done, {files} files, {size} bytes extracted')
+            return
+        if incremental:
+            ResetHelper._plan_incremental(engine, slot_path, reset_path, reset_type, diff)
+        else:
+            ResetHelper._plan_full(engine, slot_path, reset_path, reset_type)
+        engine.run()
+        logger().info(f'Reset done, strategy used: {engine.summary()}')
+
+    @staticmethod
+    def _plan_delete(engine: ResetEngine, slot_path, reset_type):
+        curr_worlds = list(filter(lambda x: os.path.isdir(x),
+            map(lambda x: os.path.join(slot_path, x), WORLDS)))
 
-        # reset main world (maybe the only world)
         curr_main_world = os.path.join(slot_path, 'world')
-        reset_main_world = os.path.join(slot_path, reset_path, 'world')
         if curr_main_world not in curr_worlds:
             pass
         elif reset_type == 'region':
             dirs = os.listdir(curr_main_world)
             for i in map(lambda x: os.path.join(curr_main_world, x),
-                filter(lambda x: x not in reserve_dirs, dirs)):
+                filter(lambda x: x not in RESERVE_DIRS, dirs)):
                 logger().info(f'Deleting world/{os.path.basename(i)}...')
-                if os.path.isdir(i):
-                    shutil.rmtree(i)
-                else:
-                    os.remove(i)
+                engine.delete(i)
         elif reset_type == 'full':
             logger().info('Deleting the whole world/')
-            shutil.rmtree(curr_main_world)
+            engine.delete(curr_main_world)
+
+        for i in WORLDS[1:]:
+            if os.path.join(slot_path, i) in curr_worlds:
+                logger().info(f'Deleting {i}')
+                engine.delete(os.path.join(slot_path, i))
+
+    @staticmethod
+    def _plan_full(engine: ResetEngine, slot_path, reset_path, reset_type):
+        reset_worlds = list(filter(lambda x: os.path.isdir(x),
+            map(lambda x: os.path.join(slot_path, reset_path, x), WORLDS)))
+        ResetHelper._plan_delete(engine, slot_path, reset_type)
 
+        # reset main world (maybe the only world)
+        curr_main_world = os.path.join(slot_path, 'world')
+        reset_main_world = os.path.join(slot_path, reset_path, 'world')
         if reset_main_world not in reset_worlds:
             logger().info('No need to reset world/')
         elif reset_type == 'region':
             dirs = os.listdir(reset_main_world)
             for i in map(lambda x: os.path.join(reset_main_world, x),
-                filter(lambda x: x not in reserve_dirs, dirs)):
+                filter(lambda x: x not in RESERVE_DIRS, dirs)):
                 logger().info(f'Resetting world/{os.path.basename(i)}')
-                if os.path.isdir(i):
-                    shutil.copytree(i, os.path.join(curr_main_world, os.path.basename(i)))
-                else:
-                    shutil.copy(i, os.path.join(curr_main_world, os.path.basename(i)))
+                engine.copy(i, os.path.join(curr_main_world, os.path.basename(i)))
         elif reset_type == 'full':
             logger().info('Resetting the whole world/')
-            shutil.copytree(reset_main_world, curr_main_world)
+            engine.copy(reset_main_world, curr_main_world)
 
-        for i in worlds[1:]:
+        for i in WORLDS[1:]:
             dir1 = os.path.join(slot_path, i)
             dir2 = os.path.join(slot_path, reset_path, i)
-            if dir1 in curr_worlds:
-                logger().info(f'Deleting {i}')
-                shutil.rmtree(dir1)
             if dir2 in reset_worlds:
                 logger().info(f'Resetting {i}')
-                shutil.copytree(dir2, dir1)
\ No newline at end of file
+                engine.copy(dir2, dir1)
+
+    @staticmethod
+    def diff(slot_path, reset_path, reset_type, workers: int = 1) -> IncrementalDiff:
+        """
+        Compare the live worlds with the manifest of the reset path
+        """
+        template_root = os.path.join(slot_path, reset_path)
+        manifest = Manifest.load(template_root)
+        if manifest.update(WORLDS):
+            manifest.save()
+
+        def is_reserved(rel: str) -> bool:
+            parts = rel.split('/')
+            return reset_type == 'region' and parts[0] == 'world' and len(parts) > 1 and parts[1] in RESERVE_DIRS
+
+        deleted_dirs, deleted_dir_set = [], set()
+
+        def is_deleted(rel: str) -> bool:
+            parts = rel.split('/')
+            return any('/'.join(parts[:i]) in deleted_dir_set for i in range(1, len(parts)))
+
+        live_files, live_dirs = scan_tree(slot_path, WORLDS)
+        kept_dirs = []
+        # parents are sorted before their children
+        for rel in sorted(live_dirs):
+            if is_reserved(rel) or is_deleted(rel):
+                continue
+            if rel in manifest.dirs or (reset_type == 'region' and rel == 'world'):
+                # world holds the reserved dirs in region mode, clean it file by file
+                kept_dirs.append(rel)
+                continue
+            deleted_dirs.append(rel)
+            deleted_dir_set.add(rel)
+
+        deleted_files, to_check = [], []
+        for rel in live_files:
+            if is_reserved(rel) or is_deleted(rel):
+                continue
+            if rel in manifest.files:
+                to_check.append(rel)
+            else:
+                deleted_files.append(rel)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            same = list(pool.map(lambda r: manifest.matches(r, to_path(slot_path, r), live_files[r]), to_check))
+        return IncrementalDiff(
+            manifest, deleted_dirs, deleted_files,
+            changed=[rel for rel, s in zip(to_check, same) if not s],
+            missing=[rel for rel in manifest.files if not is_reserved(rel) and rel not in live_files],
+            missing_dirs=[rel for rel in manifest.dirs if not is_reserved(rel) and rel not in live_dirs],
+            unchanged=[rel for rel, s in zip(to_check, same) if s],
+            kept_dirs=kept_dirs)
+
+    @staticmethod
+    def _plan_incremental(engine: ResetEngine, slot_path, reset_path, reset_type,
+                          diff: Optional[IncrementalDiff] = None):
+        """
+        Only delete, restore or overwrite the files that differ from the manifest of the reset path
+        :param diff: computed already, e.g. by a partial snapshot which moved the changed files away
+        """
+        template_root = os.path.join(slot_path, reset_path)
+        if diff is None:
+            diff = ResetHelper.diff(slot_path, reset_path, reset_type, engine.workers)
+        for rel in diff.deleted_dirs + diff.deleted_files:
+            engine.delete(to_path(slot_path, rel))
+        for rel in diff.changed + diff.missing:
+            engine.copy(to_path(template_root, rel), to_path(slot_path, rel))
+        for rel in diff.missing_dirs:
+            engine.mkdir(to_path(template_root, rel), to_path(slot_path, rel))
+        logger().info(f'Incremental reset: {len(diff.changed) + len(diff.missing)} file(s) to restore, '
+                      f'{len(diff.deleted_files)} file(s) and {len(diff.deleted_dirs)} dir(s) to delete, '
+                      f'{len(diff.unchanged)} unchanged')
+
@@ -0,0 +1,69 @@
+"""
+File level work of reset, run by the thread or process workers.
+Nothing here imports psi or the utils, a process worker is not inside MCDR
+"""
+import os
+import shutil
+import stat
+from typing import Tuple
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+# ioctl request number of FICLONE, see linux/fs.h
+FICLONE = 0x40049409
+
+# devices which have refused a reflink, skip trying on them again
+_no_reflink_devices = set()
+
+
+def reflink(src: str, dst: str) -> bool:
+    """
+    Clone src to dst with FICLONE, return False if the filesystem does not support it
+    """
+    if fcntl is None:
+        return False
+    src_dev = os.stat(src).st_dev
+    if src_dev in _no_reflink_devices:
+        return False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        # the fallback is counted as copy in the summary of the engine
+        _no_reflink_devices.add(src_dev)
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+
+def clone_file(src: str, dst: str, mode: str = 'copy') -> Tuple[str, int]:
+    """
+    Clone a single file with the given mode
+    :return: the strategy actually used and the size of the file
+    """
+    # replace instead of writing into the old file, which may be linked elsewhere
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'reflink' and reflink(src, dst):
+        shutil.copystat(src, dst)
+        strategy = 'reflink'
+    else:
+        shutil.copy2(src, dst)
+        strategy = 'copy'
+    st = os.stat(dst)
+    # the template file may be a read-only blob of the store, the server must be able to write the live one
+    if not st.st_mode & stat.S_IWUSR:
+        os.chmod(dst, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+    return strategy, st.st_size
+
+
+def delete_file(path: str) -> int:
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
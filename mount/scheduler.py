@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import time
+from threading import Condition, Thread, current_thread
+from typing import Callable, List, Optional, Tuple
+
+from .utils import debug, logger, span
+
+
+class Task:
+    """
+    Handle of a scheduled callback, repeated every interval seconds if interval > 0
+    """
+    __slots__ = ('name', 'interval', 'callback', 'cancelled')
+
+    def __init__(self, name: str, interval: float, callback: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        # dropped lazily when it reaches the top of the heap
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    One thread running all the periodic work of this plugin, sleeps until the nearest deadline.
+    Callbacks run on the scheduler thread one by one, so they should be short
+    """
+    def __init__(self):
+        self._cond = Condition()
+        # (deadline, seq, task), seq keeps the order of tasks with the same deadline
+        self._heap: List[Tuple[float, int, Task]] = []
+        self._seq = itertools.count()
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+
+    def schedule(self, interval: float, callback: Callable[[], None], name: Optional[str] = None,
+                 delay: Optional[float] = None) -> Task:
+        """
+        Run callback every interval seconds, the first run is after delay seconds, default to interval
+        """
+        task = Task(name or getattr(callback, '__name__', 'task'), interval, callback)
+        self._push(time.monotonic() + (interval if delay is None else delay), task)
+        return task
+
+    def call_later(self, delay: float, callback: Callable[[], None], name: Optional[str] = None) -> Task:
+        """
+        Run callback once after delay seconds
+        """
+        task = Task(name or getattr(callback, '__name__', 'task'), 0, callback)
+        self._push(time.monotonic() + delay, task)
+        return task
+
+    def _push(self, deadline: float, task: Task):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = Thread(target=self._run, name='MountScheduler', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (deadline, next(self._seq), task))
+            self._cond.notify()
+
+    def _run(self):
+        debug('Scheduler started')
+        while True:
+            with self._cond:
+                # a stopped scheduler may be started again before the old thread exits
+                while not self._stopped and self._thread is current_thread():
+                    now = time.monotonic()
+                    if len(self._heap) > 0 and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(None if len(self._heap) == 0 else self._heap[0][0] - now)
+                if self._stopped or self._thread is not current_thread():
+                    debug('Scheduler stopped')
+                    return
+                deadline, _, task = heapq.heappop(self._heap)
+            if task.cancelled:
+                continue
+            try:
+                with span('scheduler_task', task=task.name):
+                    task.callback()
+            except Exception as e:
+                logger().exception(f'Scheduled task {task.name} failed: {e}')
+            if task.interval > 0 and not task.cancelled:
+                with self._cond:
+                    if self._stopped:
+                        continue
+                    # skip the missed runs instead of catching up
+                    heapq.heappush(self._heap, (max(deadline + task.interval, time.monotonic()),
+                                                next(self._seq), task))
+
+    def stop(self, timeout: float = 5):
+        """
+        Drop all tasks and wait for the running one to finish
+        """
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+
+scheduler = Scheduler()
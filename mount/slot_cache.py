@@ -0,0 +1,50 @@
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from .config import SlotConfig, SlotSummary
+from .storage import get_storage
+from .utils import debug, logger, trace
+
+
+class SlotCache:
+    """
+    Slot summaries keyed by path, reloaded only when the version of the slot config in the storage changes,
+    e.g. the mtime and size of the mountable config
+    """
+    def __init__(self):
+        self._lock = Lock()
+        # path -> ((storage name, *version), summary)
+        self._entries: Dict[str, Tuple[tuple, SlotSummary]] = {}
+
+    def get(self, path: str) -> SlotSummary:
+        storage = get_storage()
+        version = storage.version(path)
+        if version is None:
+            # not initialized yet, show it as a default one
+            return SlotSummary(path, SlotConfig())
+        key = (storage.name, *version)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        debug('Slot cache miss for %s, loading...', path)
+        trace('slot_cache_miss', path=path)
+        try:
+            config = storage.read(path)
+        except (OSError, ValueError) as e:
+            logger().warning(f'Failed to read slot config in {path}: {e}')
+            return SlotSummary(path, SlotConfig())
+        summary = SlotSummary(path, config)
+        with self._lock:
+            self._entries[path] = (key, summary)
+        return summary
+
+    def invalidate(self, path: Optional[str] = None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+
+slot_cache = SlotCache()
@@ -0,0 +1,154 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from threading import Event, Thread
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .constants import IGNORE_PATTEN
+from .scheduler import Task, scheduler
+from .utils import debug, logger
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def load_inotify():
+    """
+    :return: libc with inotify functions, None if not available
+    """
+    if not hasattr(os, 'O_NONBLOCK'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class SlotWatcher(Thread):
+    """
+    Watch the detect paths for added, removed and ignore toggled slot dirs, with inotify if available
+    or polling on the shared scheduler otherwise, bursts of events are debounced into one callback
+    """
+    def __init__(self, roots: Iterable[str], interval: float, cb: Callable[[], None]):
+        super().__init__()
+        self.setDaemon(True)
+        self.setName(self.__class__.__name__)
+        self.roots = list(roots)
+        self.interval = max(interval, 0.1)
+        self.stop_event = Event()
+        self._callback = cb
+        self._libc = load_inotify()
+        self._fd = -1
+        self._wake_fd = -1
+        self._poll_task: Optional[Task] = None
+        # watch descriptor -> (path, is root)
+        self._watches: Dict[int, Tuple[str, bool]] = {}
+
+    def run(self):
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            logger().info('inotify is not available, watching servers path by polling')
+            self._poll_task = scheduler.schedule(self.interval, self._fire, 'slot watcher polling')
+            return
+        debug('Watching servers path with inotify')
+        # written by stop() to wake up select
+        wake_fd, self._wake_fd = os.pipe()
+        try:
+            self._sync_watches()
+            dirty_since: Optional[float] = None
+            while not self.stop_event.is_set():
+                # sleep until an event comes, or the burst is over
+                timeout = None if dirty_since is None else max(dirty_since + self.interval - time.time(), 0)
+                ready, _, _ = select.select([self._fd, wake_fd], [], [], timeout)
+                if self._fd in ready and self._read_events():
+                    dirty_since = time.time()
+                if dirty_since is not None and time.time() - dirty_since >= self.interval:
+                    dirty_since = None
+                    self._fire()
+                    self._sync_watches()
+        finally:
+            w, self._wake_fd = self._wake_fd, -1
+            for fd in (self._fd, wake_fd, w):
+                os.close(fd)
+            self._fd = -1
+
+    def _fire(self):
+        try:
+            self._callback()
+        except Exception as e:
+            logger().error(f'Failed to sync slots: {e}')
+
+    def _add_watch(self, path: str, is_root: bool):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            debug('Failed to watch %s: %s', path, os.strerror(ctypes.get_errno()))
+            return
+        self._watches[wd] = (path, is_root)
+
+    def _sync_watches(self):
+        """
+        Watch every root and its sub dirs, the sub dirs are watched for the ignore file only
+        """
+        watched = set(self._watches.values())
+        for root in self.roots:
+            if (root, True) not in watched:
+                self._add_watch(root, True)
+            try:
+                with os.scandir(root) as it:
+                    for entry in it:
+                        if entry.is_dir() and (entry.path, False) not in watched:
+                            self._add_watch(entry.path, False)
+            except OSError:
+                continue
+
+    def _read_events(self) -> bool:
+        """
+        :return: True if any event may change the slot list
+        """
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return False
+        dirty, offset = False, 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size: offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            watch = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if watch is None:
+                continue
+            _, is_root = watch
+            if is_root and (mask & IN_ISDIR or mask & IN_DELETE_SELF):
+                dirty = True
+            elif not is_root and os.fsdecode(name) == IGNORE_PATTEN:
+                dirty = True
+        return dirty
+
+    def stop(self):
+        self.stop_event.set()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        try:
+            if self._wake_fd >= 0:
+                os.write(self._wake_fd, b'\0')
+        except OSError:
+            pass
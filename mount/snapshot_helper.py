@@ -0,0 +1,251 @@
+import json
+import os
+import shutil
+import time
+from typing import List, Optional, Tuple
+
+from .constants import RESERVE_DIRS, SNAPSHOT_DIR, SNAPSHOT_KEEP_MARK, SNAPSHOT_PARTIAL, WORLDS
+from .manifest import Manifest, scan_tree, to_path
+from .reset_helper import IncrementalDiff
+from .reset_worker import clone_file
+from .utils import debug, logger
+
+SNAPSHOT_ID_FORMAT = '%Y%m%d-%H%M%S'
+
+
+def snapshot_root(slot_path: str) -> str:
+    return os.path.join(slot_path, SNAPSHOT_DIR)
+
+
+def new_snapshot_id() -> str:
+    return time.strftime(SNAPSHOT_ID_FORMAT)
+
+
+def snapshot_time(snapshot_id: str) -> float:
+    try:
+        return time.mktime(time.strptime(snapshot_id[:15], SNAPSHOT_ID_FORMAT))
+    except ValueError:
+        return 0
+
+
+class RollbackError(Exception):
+    """
+    A rollback failed partway, the worlds replaced so far are in snapshot replaced,
+    both snapshots are marked to be kept from eviction
+    """
+    def __init__(self, snapshot_id: str, replaced: str, cause: OSError):
+        super().__init__(f'{snapshot_id}: {cause}')
+        self.snapshot_id = snapshot_id
+        self.replaced = replaced
+        self.cause = cause
+
+
+class SnapshotHelper:
+    """
+    Snapshots of the live worlds are taken by renaming them aside, which costs no copy,
+    the following reset restores into an empty world.
+    Before an incremental reset, only the files it would delete or overwrite are moved aside,
+    the unchanged ones are restored from the reset path on rollback
+    """
+    @staticmethod
+    def get_snapshots(slot_path: str) -> List[str]:
+        """
+        :return: ids of the snapshots, newest first
+        """
+        root = snapshot_root(slot_path)
+        if not os.path.isdir(root):
+            return []
+        return sorted(filter(lambda x: os.path.isdir(os.path.join(root, x)), os.listdir(root)), reverse=True)
+
+    @staticmethod
+    def _move_worlds(src: str, dst: str, reset_type: str):
+        """
+        Move world dirs from src to dst, reserved dirs stay in src in region mode
+        """
+        for dim in WORLDS:
+            world = os.path.join(src, dim)
+            if not os.path.isdir(world):
+                continue
+            os.makedirs(dst, exist_ok=True)
+            os.rename(world, os.path.join(dst, dim))
+            if dim == 'world' and reset_type == 'region':
+                for i in RESERVE_DIRS:
+                    if os.path.isdir(os.path.join(dst, dim, i)):
+                        os.makedirs(world, exist_ok=True)
+                        os.rename(os.path.join(dst, dim, i), os.path.join(world, i))
+
+    @staticmethod
+    def _new_target(slot_path: str) -> Tuple[str, str]:
+        snapshot_id = new_snapshot_id()
+        target = os.path.join(snapshot_root(slot_path), snapshot_id)
+        while os.path.exists(target):
+            snapshot_id += '_'
+            target = os.path.join(snapshot_root(slot_path), snapshot_id)
+        return snapshot_id, target
+
+    @staticmethod
+    def take(slot_path: str, reset_type: str) -> Optional[str]:
+        """
+        Move the live worlds into a new snapshot
+        :return: id of the snapshot, None if nothing to snapshot
+        """
+        if not any(os.path.isdir(os.path.join(slot_path, dim)) for dim in WORLDS):
+            return None
+        snapshot_id, target = SnapshotHelper._new_target(slot_path)
+        logger().info(f'Taking snapshot {snapshot_id} of {slot_path}...')
+        SnapshotHelper._move_worlds(slot_path, target, reset_type)
+        return snapshot_id
+
+    @staticmethod
+    def take_partial(slot_path: str, reset_path: str, diff: IncrementalDiff) -> Optional[str]:
+        """
+        Move the files to be deleted or overwritten by the incremental reset of diff into a new snapshot,
+        the reset can go on with the same diff without deleting them
+        :return: id of the snapshot, None if nothing to snapshot
+        """
+        moving = diff.deleted_dirs + diff.deleted_files + diff.changed
+        if len(moving) == 0 and len(diff.unchanged) == 0:
+            return None
+        snapshot_id, target = SnapshotHelper._new_target(slot_path)
+        logger().info(f'Taking partial snapshot {snapshot_id} of {slot_path}, {len(moving)} changed, '
+                      f'{len(diff.unchanged)} unchanged...')
+        os.makedirs(target)
+        # unchanged files are checked against their hash in the reset path before rollback
+        with open(os.path.join(target, SNAPSHOT_PARTIAL), 'w', encoding='utf-8') as f:
+            json.dump({'reset_path': reset_path, 'dirs': diff.kept_dirs,
+                       'files': {rel: diff.manifest.files[rel][2] for rel in diff.unchanged}}, f)
+        moved = []
+        try:
+            for rel in moving:
+                dst = to_path(target, rel)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.rename(to_path(slot_path, rel), dst)
+                moved.append(rel)
+        except OSError:
+            # put them back, the reset is not going on
+            for rel in reversed(moved):
+                os.rename(to_path(target, rel), to_path(slot_path, rel))
+            shutil.rmtree(target, ignore_errors=True)
+            raise
+        return snapshot_id
+
+    @staticmethod
+    def _load_partial(source: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(source, SNAPSHOT_PARTIAL), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _check_partial(slot_path: str, snapshot_id: str, partial: dict):
+        """
+        :raise ValueError: if an unchanged file can't be restored from the reset path any more
+        """
+        template = os.path.join(slot_path, partial['reset_path'])
+        if not os.path.isdir(template):
+            raise ValueError(f'reset path {template} of partial snapshot {snapshot_id} is gone')
+        manifest = Manifest.load(template)
+        if manifest.update(WORLDS):
+            manifest.save()
+        for rel, digest in partial['files'].items():
+            entry = manifest.files.get(rel)
+            if entry is None or entry[2] != digest:
+                raise ValueError(f'{rel} in reset path changed since partial snapshot {snapshot_id}')
+
+    @staticmethod
+    def _restore_partial(slot_path: str, source: str, partial: dict):
+        template = os.path.join(slot_path, partial['reset_path'])
+        files, dirs = scan_tree(source, WORLDS)
+        for rel in sorted(dirs.union(partial['dirs'])):
+            os.makedirs(to_path(slot_path, rel), exist_ok=True)
+        for rel in files:
+            os.rename(to_path(source, rel), to_path(slot_path, rel))
+        for rel in partial['files']:
+            clone_file(to_path(template, rel), to_path(slot_path, rel), 'reflink')
+
+    @staticmethod
+    def _mark_keep(slot_path: str, snapshot_id: str):
+        try:
+            path = os.path.join(snapshot_root(slot_path), snapshot_id)
+            os.makedirs(path, exist_ok=True)
+            open(os.path.join(path, SNAPSHOT_KEEP_MARK), 'w').close()
+        except OSError as e:
+            logger().error(f'Failed to mark snapshot {snapshot_id} to keep: {e}')
+
+    @staticmethod
+    def rollback(slot_path: str, snapshot_id: str) -> Optional[str]:
+        """
+        Swap the snapshot back as live worlds, the current worlds become a new snapshot,
+        reserved dirs missing in the snapshot are taken from the current worlds
+        :return: id of the snapshot holding the replaced worlds
+        :raise ValueError: if the snapshot is partial and its reset path changed, nothing is changed then
+        """
+        source = os.path.join(snapshot_root(slot_path), snapshot_id)
+        if not os.path.isdir(source):
+            raise FileNotFoundError(source)
+        partial = SnapshotHelper._load_partial(source)
+        if partial is not None:
+            SnapshotHelper._check_partial(slot_path, snapshot_id, partial)
+        has_worlds = any(os.path.isdir(os.path.join(slot_path, dim)) for dim in WORLDS)
+        replaced, target = SnapshotHelper._new_target(slot_path)
+        logger().info(f'Rolling back {slot_path} to snapshot {snapshot_id}, current worlds go to {replaced}...')
+        try:
+            if has_worlds:
+                SnapshotHelper._move_worlds(slot_path, target, 'full')
+            if partial is not None:
+                SnapshotHelper._restore_partial(slot_path, source, partial)
+            else:
+                for dim in WORLDS:
+                    if os.path.isdir(os.path.join(source, dim)):
+                        os.rename(os.path.join(source, dim), os.path.join(slot_path, dim))
+            if has_worlds:
+                replaced_world = os.path.join(target, 'world')
+                for i in RESERVE_DIRS:
+                    restored = os.path.join(slot_path, 'world', i)
+                    if not os.path.exists(restored) and os.path.isdir(os.path.join(replaced_world, i)):
+                        os.makedirs(os.path.join(slot_path, 'world'), exist_ok=True)
+                        os.rename(os.path.join(replaced_world, i), restored)
+        except OSError as e:
+            logger().error(f'Rollback of {slot_path} to {snapshot_id} failed: {e}, '
+                           f'replaced worlds are in snapshot {replaced}')
+            SnapshotHelper._mark_keep(slot_path, snapshot_id)
+            if os.path.isdir(target):
+                SnapshotHelper._mark_keep(slot_path, replaced)
+            raise RollbackError(snapshot_id, replaced, e) from e
+        shutil.rmtree(source, ignore_errors=True)
+        return replaced if has_worlds else None
+
+    @staticmethod
+    def evict(slot_path: str, count: int, max_age_hours: int = 0, budget_mb: int = 0):
+        """
+        Keep at most count snapshots, drop the ones older than max_age_hours,
+        then the oldest ones until the total size fits budget_mb, 0 for no limit.
+        The newest one is always kept, e.g. the worlds replaced by the last rollback,
+        and so are the ones marked by a failed rollback
+        """
+        root = snapshot_root(slot_path)
+        snapshots = [i for i in SnapshotHelper.get_snapshots(slot_path)
+                     if not os.path.exists(os.path.join(root, i, SNAPSHOT_KEEP_MARK))]
+        if len(snapshots) == 0:
+            return
+        expired = snapshots[max(count, 1):]
+        kept = snapshots[:max(count, 1)]
+        if max_age_hours > 0:
+            deadline = time.time() - max_age_hours * 3600
+            expired.extend(i for i in kept[1:] if snapshot_time(i) < deadline)
+            kept = [i for i in kept if i not in expired]
+        if budget_mb > 0:
+            total = 0
+            for i in list(kept):
+                files, _ = scan_tree(os.path.join(root, i), WORLDS)
+                total += sum(size for size, _ in files.values())
+                # the newest one is always kept
+                if total > budget_mb * 1048576 and i != kept[0]:
+                    expired.append(i)
+                    kept.remove(i)
+        for i in expired:
+            debug('Evicting snapshot %s of %s', i, slot_path)
+            shutil.rmtree(os.path.join(root, i), ignore_errors=True)
+        if len(expired) > 0:
+            logger().info(f'Evicted {len(expired)} snapshot(s) of {slot_path}')
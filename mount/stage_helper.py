@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from .constants import RESERVE_DIRS, STAGE_DIR, STAGE_MARK, SWAP_FAILED_MARK, TRASH_DIR, WORLDS
+from .archive_helper import ArchiveHelper
+from .manifest import Manifest, scan_tree
+from .reset_helper import ResetEngine
+from .utils import debug, logger
+
+_staging_lock = Lock()
+_staging_slots = set()
+
+
+class StageSwapError(Exception):
+    """
+    A swap failed and couldn't be undone, the old worlds are left in trash, which is kept by cleanup
+    """
+    def __init__(self, trash: str, cause: OSError):
+        super().__init__(f'{trash}: {cause}')
+        self.trash = trash
+        self.cause = cause
+
+
+class StageHelper:
+    """
+    Keep fresh copies of the reset path ready under STAGE_DIR of the slot,
+    so that a reset only needs to swap the world dirs by rename
+    """
+    @staticmethod
+    def signature(slot_path: str, reset_path: str, reset_type: str) -> str:
+        template = os.path.join(slot_path, reset_path)
+        if ArchiveHelper.is_archive(template):
+            st = os.stat(template)
+            payload = json.dumps([reset_type, st.st_size, st.st_mtime_ns])
+            return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+        manifest = Manifest.load(os.path.join(slot_path, reset_path))
+        if manifest.update(WORLDS):
+            manifest.save()
+        payload = json.dumps([reset_type, manifest.files], sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    @staticmethod
+    def template_size(slot_path: str, reset_path: str) -> int:
+        if ArchiveHelper.is_archive(os.path.join(slot_path, reset_path)):
+            # unknown before extracting, measure a staged copy instead
+            stages = StageHelper.ready_stages(slot_path)
+            if len(stages) == 0:
+                return 0
+            files, _ = scan_tree(stages[0], WORLDS)
+            return sum(size for size, _ in files.values())
+        manifest = Manifest.load(os.path.join(slot_path, reset_path))
+        manifest.update(WORLDS)
+        return sum(entry[0] for entry in manifest.files.values())
+
+    @staticmethod
+    def _read_mark(stage: str) -> Optional[str]:
+        try:
+            with open(os.path.join(stage, STAGE_MARK), 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _mark_ready(tmp: str, target: str, sign: str):
+        with open(os.path.join(tmp, STAGE_MARK), 'w', encoding='utf-8') as f:
+            f.write(sign)
+        os.rename(tmp, target)
+
+    @staticmethod
+    def ready_stages(slot_path: str) -> List[str]:
+        stage_root = os.path.join(slot_path, STAGE_DIR)
+        if not os.path.isdir(stage_root):
+            return []
+        return sorted(os.path.join(stage_root, i) for i in os.listdir(stage_root) if not i.endswith('.tmp'))
+
+    @staticmethod
+    def stage(slot_path: str, reset_path: str, reset_type: str, reset_mode: str = 'copy',
+              count: int = 1, budget_mb: int = 0, workers: int = 1):
+        """
+        Fill the pool up to count ready copies, within budget_mb (0 for unlimited)
+        """
+        with _staging_lock:
+            if slot_path in _staging_slots:
+                debug('Slot %s is already staging, skip', slot_path)
+                return
+            _staging_slots.add(slot_path)
+        try:
+            sign = StageHelper.signature(slot_path, reset_path, reset_type)
+            size = StageHelper.template_size(slot_path, reset_path)
+            stage_root = os.path.join(slot_path, STAGE_DIR)
+            while True:
+                ready = [i for i in StageHelper.ready_stages(slot_path) if StageHelper._read_mark(i) == sign]
+                if len(ready) >= count:
+                    break
+                if budget_mb > 0 and (len(ready) + 1) * size > budget_mb * 1048576:
+                    logger().info(f'Staging another world for {slot_path} would exceed the budget, stop')
+                    break
+                target = os.path.join(stage_root, str(time.time_ns()))
+                tmp = target + '.tmp'
+                logger().info(f'Staging a fresh world for {slot_path}...')
+                os.makedirs(tmp)
+                if ArchiveHelper.is_archive(os.path.join(slot_path, reset_path)):
+                    ArchiveHelper.extract(os.path.join(slot_path, reset_path), tmp, reset_type)
+                    StageHelper._mark_ready(tmp, target, sign)
+                    size = StageHelper.template_size(slot_path, reset_path)
+                    continue
+                engine = ResetEngine(reset_mode, workers)
+                for dim in WORLDS:
+                    src = os.path.join(slot_path, reset_path, dim)
+                    if not os.path.isdir(src):
+                        continue
+                    if dim == 'world' and reset_type == 'region':
+                        engine.mkdir(src, os.path.join(tmp, dim))
+                        for i in filter(lambda x: x not in RESERVE_DIRS, os.listdir(src)):
+                            engine.copy(os.path.join(src, i), os.path.join(tmp, dim, i))
+                    else:
+                        engine.copy(src, os.path.join(tmp, dim))
+                engine.run()
+                StageHelper._mark_ready(tmp, target, sign)
+                logger().info(f'Staged world ready for {slot_path}, strategy used: {engine.summary()}')
+        finally:
+            with _staging_lock:
+                _staging_slots.discard(slot_path)
+
+    @staticmethod
+    def swap(slot_path: str, reset_path: str, reset_type: str) -> bool:
+        """
+        Swap the live worlds with a ready copy, the old worlds are moved into TRASH_DIR
+        :return: False if no usable copy, the caller should reset in the usual way
+        """
+        sign = StageHelper.signature(slot_path, reset_path, reset_type)
+        stage = next((i for i in StageHelper.ready_stages(slot_path) if StageHelper._read_mark(i) == sign), None)
+        if stage is None:
+            debug('No staged world for %s', slot_path)
+            return False
+        trash = os.path.join(slot_path, TRASH_DIR, str(time.time_ns()))
+        logger().info(f'Swapping worlds with staged copy {os.path.basename(stage)}...')
+        # (src, dst) of every rename done, dst None for a dir created, undone in reverse on failure
+        journal: List[Tuple[str, Optional[str]]] = []
+
+        def move(src: str, dst: str):
+            os.rename(src, dst)
+            journal.append((src, dst))
+
+        try:
+            os.makedirs(trash)
+            for dim in WORLDS:
+                live = os.path.join(slot_path, dim)
+                if os.path.isdir(live):
+                    move(live, os.path.join(trash, dim))
+                if os.path.isdir(os.path.join(stage, dim)):
+                    move(os.path.join(stage, dim), live)
+            if reset_type == 'region':
+                for i in RESERVE_DIRS:
+                    reserved = os.path.join(trash, 'world', i)
+                    if os.path.isdir(reserved):
+                        world = os.path.join(slot_path, 'world')
+                        if not os.path.isdir(world):
+                            os.mkdir(world)
+                            journal.append((world, None))
+                        move(reserved, os.path.join(world, i))
+            move(stage, os.path.join(trash, STAGE_DIR))
+        except OSError as e:
+            logger().error(f'Failed to swap staged world: {e}, moving the worlds back...')
+            try:
+                for src, dst in reversed(journal):
+                    if dst is None:
+                        os.rmdir(src)
+                    else:
+                        os.rename(dst, src)
+            except OSError as undo_error:
+                logger().error(f'Failed to move the worlds back: {undo_error}, they are kept in {trash}')
+                try:
+                    open(os.path.join(trash, SWAP_FAILED_MARK), 'w').close()
+                except OSError:
+                    pass
+                raise StageSwapError(trash, undo_error) from e
+            try:
+                os.rmdir(trash)
+            except OSError:
+                pass
+            logger().info('Worlds moved back, fallback to normal reset')
+            return False
+        return True
+
+    @staticmethod
+    def cleanup(slot_path: str, reset_path: Optional[str] = None, reset_type: Optional[str] = None):
+        """
+        Delete the swapped out worlds, and stale copies if the reset path is given
+        """
+        trash = os.path.join(slot_path, TRASH_DIR)
+        if os.path.isdir(trash):
+            logger().info(f'Cleaning up old worlds of {slot_path}...')
+            for i in os.listdir(trash):
+                if os.path.exists(os.path.join(trash, i, SWAP_FAILED_MARK)):
+                    logger().warning(f'Keeping {os.path.join(trash, i)} left by a failed swap, please restore it manually')
+                    continue
+                shutil.rmtree(os.path.join(trash, i), ignore_errors=True)
+        stage_root = os.path.join(slot_path, STAGE_DIR)
+        if reset_path in ['', None, '.'] or not os.path.isdir(stage_root):
+            return
+        sign = StageHelper.signature(slot_path, reset_path, reset_type)
+        with _staging_lock:
+            if slot_path in _staging_slots:
+                return
+            for i in os.listdir(stage_root):
+                stage = os.path.join(stage_root, i)
+                if i.endswith('.tmp') or StageHelper._read_mark(stage) != sign:
+                    debug('Removing stale staged world %s', stage)
+                    shutil.rmtree(stage, ignore_errors=True)
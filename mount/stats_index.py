@@ -0,0 +1,78 @@
+import bisect
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+from .config import SlotStats, SlotSummary
+from .slot_cache import slot_cache
+
+# sort key of --stats -> field of SlotStats
+STATS_SORT_KEYS = {
+    'use_time': 'total_use_time',
+    'player_time': 'total_player_time',
+    'players': 'total_players',
+    'last_mount': 'last_mount_ns'
+}
+
+
+class StatsIndex:
+    """
+    Stats of all slots kept sorted by every sort key, updated slot by slot,
+    so ranking won't read every mountable config
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._stats: Dict[str, SlotStats] = {}
+        # summary the stats of each slot come from, a new one from the slot cache means a changed config
+        self._sources: Dict[str, SlotSummary] = {}
+        # sort key -> ascending [(value, path)]
+        self._ranks: Dict[str, List[Tuple[int, str]]] = {key: [] for key in STATS_SORT_KEYS}
+
+    def _remove(self, path: str):
+        stats = self._stats.pop(path, None)
+        self._sources.pop(path, None)
+        if stats is None:
+            return
+        for key, field in STATS_SORT_KEYS.items():
+            ranks = self._ranks[key]
+            i = bisect.bisect_left(ranks, (stats.__getattribute__(field), path))
+            if i < len(ranks) and ranks[i][1] == path:
+                ranks.pop(i)
+
+    def update(self, path: str, stats: SlotStats):
+        with self._lock:
+            self._remove(path)
+            self._stats[path] = stats
+            for key, field in STATS_SORT_KEYS.items():
+                bisect.insort(self._ranks[key], (stats.__getattribute__(field), path))
+
+    def refresh(self, paths: Iterable[str]):
+        """
+        Sync the index with the given slots, only the configs changed on disk are read again
+        """
+        paths = set(paths)
+        with self._lock:
+            for path in set(self._stats) - paths:
+                self._remove(path)
+        for path in paths:
+            summary = slot_cache.get(path)
+            with self._lock:
+                if self._sources.get(path) is summary:
+                    continue
+            self.update(path, summary.config.stats)
+            with self._lock:
+                self._sources[path] = summary
+
+    def rank(self, sort_key: str, start: int, end: int) -> List[Tuple[str, SlotStats]]:
+        """
+        :return: path and stats of slots ranked in [start, end) by sort_key, descending
+        """
+        with self._lock:
+            ranks = self._ranks[sort_key]
+            picked = ranks[max(len(ranks) - end, 0): max(len(ranks) - start, 0)]
+            return [(path, self._stats[path]) for _, path in reversed(picked)]
+
+    def __len__(self):
+        return len(self._stats)
+
+
+stats_index = StatsIndex()
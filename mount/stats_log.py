@@ -0,0 +1,160 @@
+import copy
+import json
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from .constants import STATS_DIR
+from .utils import debug, logger
+
+HOUR = 3600
+DAY = 24 * HOUR
+# rollups older than these are dropped, keeps the rollup file bounded
+HOURLY_RETENTION = 14 * DAY
+DAILY_RETENTION = 730 * DAY
+# compact the event log once it grows over this size
+COMPACT_THRESHOLD = 64 * 1024
+EVENTS = ['mount', 'unmount', 'join', 'leave']
+
+
+def _empty_rollup() -> dict:
+    return {'until': 0, 'state': {'mounted_since': None, 'online': {}}, 'hourly': {}, 'daily': {}}
+
+
+def _add(rollup: dict, start_ns: int, end_ns: int, index: int, weight: int = 1):
+    """
+    Add the interval into hourly and daily buckets, split at bucket borders
+    """
+    for name, size in (('hourly', HOUR), ('daily', DAY)):
+        buckets = rollup[name]
+        t = start_ns
+        while t < end_ns:
+            bucket = t // 1_000_000_000 // size * size
+            border = min((bucket + size) * 1_000_000_000, end_ns)
+            entry = buckets.setdefault(str(bucket), [0, 0, 0])
+            entry[index] += (border - t) * weight
+            t = border
+
+
+def _count(rollup: dict, t_ns: int, index: int):
+    for name, size in (('hourly', HOUR), ('daily', DAY)):
+        bucket = t_ns // 1_000_000_000 // size * size
+        rollup[name].setdefault(str(bucket), [0, 0, 0])[index] += 1
+
+
+class StatsLog:
+    """
+    Append-only log of mount, unmount, join and leave events of a slot, one
+    "<time_ns> <event> [player]" per line. It is compacted into hourly and daily
+    buckets of [use_ns, player_ns, joins] in a rollup file.
+    """
+    def __init__(self, slot_path: str):
+        self.root = os.path.join(slot_path, STATS_DIR)
+        self.log_file = os.path.join(self.root, 'events.log')
+        self.rollup_file = os.path.join(self.root, 'rollup.json')
+        self._lock = Lock()
+
+    def append(self, event: str, player: str = ''):
+        line = f'{time.time_ns()} {event} {player}'.rstrip() + '\n'
+        with self._lock:
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                logger().error(f'Failed to append stats event to {self.log_file}: {e}')
+
+    def _read_events(self) -> List[Tuple[int, str, str]]:
+        events = []
+        try:
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split(' ', 2)
+                    if len(parts) < 2 or not parts[0].isdigit() or parts[1] not in EVENTS:
+                        continue
+                    events.append((int(parts[0]), parts[1], parts[2] if len(parts) > 2 else ''))
+        except FileNotFoundError:
+            pass
+        return events
+
+    def _load_rollup(self) -> dict:
+        try:
+            with open(self.rollup_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return _empty_rollup()
+        except ValueError:
+            logger().warning(f'Broken stats rollup {self.rollup_file}, starting a new one')
+            return _empty_rollup()
+
+    @staticmethod
+    def _fold(rollup: dict, events: List[Tuple[int, str, str]], until_ns: int) -> dict:
+        """
+        Fold the events into rollup, open sessions are accounted up to until_ns
+        """
+        state = rollup['state']
+        mounted: Optional[int] = state['mounted_since']
+        online: Dict[str, int] = state['online']
+        for t, event, player in events:
+            # folded already by a compaction interrupted before truncating the log
+            if t < rollup['until']:
+                continue
+            if event == 'mount' and mounted is None:
+                mounted = t
+            elif event == 'unmount':
+                if mounted is not None:
+                    _add(rollup, mounted, t, 0)
+                    mounted = None
+                for since in online.values():
+                    _add(rollup, since, t, 1)
+                online = {}
+            elif event == 'join':
+                online[player] = t
+                _count(rollup, t, 2)
+            elif event == 'leave' and player in online:
+                _add(rollup, online.pop(player), t, 1)
+        if mounted is not None:
+            _add(rollup, mounted, until_ns, 0)
+            mounted = until_ns
+        for player, since in online.items():
+            _add(rollup, since, until_ns, 1)
+            online[player] = until_ns
+        rollup['state'] = {'mounted_since': mounted, 'online': online}
+        rollup['until'] = max(rollup['until'], until_ns)
+        now = until_ns // 1_000_000_000
+        for name, retention in (('hourly', HOURLY_RETENTION), ('daily', DAILY_RETENTION)):
+            rollup[name] = {k: v for k, v in rollup[name].items() if int(k) >= now - retention}
+        return rollup
+
+    def compact(self, force: bool = False):
+        """
+        Roll the event log up into buckets, then truncate it
+        """
+        with self._lock:
+            try:
+                if not force and os.path.getsize(self.log_file) < COMPACT_THRESHOLD:
+                    return
+            except OSError:
+                return
+            debug('Compacting stats log %s...', self.log_file)
+            rollup = self._fold(self._load_rollup(), self._read_events(), time.time_ns())
+            tmp = self.rollup_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(rollup, f)
+            os.replace(tmp, self.rollup_file)
+            open(self.log_file, 'w').close()
+
+    def usage(self, start: float, end: float, granularity: str = 'hour') -> List[Tuple[int, int, int, int]]:
+        """
+        Usage of this slot between two timestamps in seconds
+        :param granularity: hour or day, hourly buckets are kept for HOURLY_RETENTION only
+        :return: (bucket start, use ns, player ns, joins) for every non-empty bucket, in time order
+        """
+        with self._lock:
+            rollup = copy.deepcopy(self._load_rollup())
+            events = self._read_events()
+        rollup = self._fold(rollup, events, time.time_ns())
+        size = HOUR if granularity == 'hour' else DAY
+        buckets = rollup['hourly' if granularity == 'hour' else 'daily']
+        return sorted((int(k), *v) for k, v in buckets.items() if start - size < int(k) < end)
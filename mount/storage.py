@@ -0,0 +1,319 @@
+import json
+import os
+import sqlite3
+import threading
+from threading import Lock
+from typing import Iterable, List, Optional
+
+from .config import SlotConfig
+from .constants import MOUNTABLE_CONFIG
+from .utils import debug, logger, psi
+
+REGISTRY_BACKENDS = ['json', 'sqlite']
+SCHEMA_VERSION = 1
+
+
+class SlotStorage:
+    """
+    Where the slot configs are kept, every read and write of a slot config goes through the current storage
+    """
+    name = ''
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def version(self, path: str) -> Optional[tuple]:
+        """
+        :return: a cheap token changed on every write of the slot config, None if it doesn't exist
+        """
+        raise NotImplementedError
+
+    def read(self, path: str) -> SlotConfig:
+        """
+        Read the slot config without any side effect
+        :raise OSError, ValueError: if it doesn't exist or is broken
+        """
+        raise NotImplementedError
+
+    def load(self, path: str) -> SlotConfig:
+        """
+        Read the slot config for a MountSlot, a missing one is created with the default values
+        """
+        raise NotImplementedError
+
+    def save(self, path: str, config: SlotConfig):
+        raise NotImplementedError
+
+    def find(self, paths: Iterable[str], checked: Optional[bool] = None, occupied_by: Optional[str] = None,
+             handler: Optional[str] = None) -> List[str]:
+        """
+        :return: the given slots matching all the given conditions, in the given order
+        """
+        result = []
+        for path in paths:
+            try:
+                config = self.read(path)
+            except (OSError, ValueError):
+                continue
+            if (checked is None or config.checked == checked) \
+                    and (occupied_by is None or config.occupied_by == occupied_by) \
+                    and (handler is None or config.handler == handler):
+                result.append(path)
+        return result
+
+    def close(self):
+        pass
+
+
+class JsonStorage(SlotStorage):
+    """
+    The default, a mountable.json in every slot
+    """
+    name = 'json'
+
+    @staticmethod
+    def file_of(path: str) -> str:
+        return os.path.join(path, MOUNTABLE_CONFIG)
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(self.file_of(path))
+
+    def version(self, path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(self.file_of(path))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def read(self, path: str) -> SlotConfig:
+        with open(self.file_of(path), 'r', encoding='utf-8') as f:
+            return SlotConfig.deserialize(json.load(f))
+
+    def load(self, path: str) -> SlotConfig:
+        return psi.load_config_simple(target_class=SlotConfig, file_name=self.file_of(path), in_data_folder=False)
+
+    def save(self, path: str, config: SlotConfig):
+        # write to a temp file unique per process and thread then rename, a crash won't leave a truncated config
+        file_name = self.file_of(path)
+        tmp = f'{file_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf8') as f:
+            json.dump(config.serialize(), f, indent=4, ensure_ascii=False)
+        os.replace(tmp, file_name)
+
+
+class SqliteStorage(SlotStorage):
+    """
+    Slot configs in a local sqlite registry shared by the mcdr instances, the fields used to find slots
+    are kept in indexed columns besides the whole config. Slots are keyed by real path, since instances
+    may reach them by different relative paths. A slot missing in the registry is imported from its
+    mountable.json on first read
+    """
+    name = 'sqlite'
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = Lock()
+        self._json = JsonStorage()
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        conn = self._conn()
+        # readers don't block the writer and each other, so several instances can share the registry
+        conn.execute('PRAGMA journal_mode=WAL')
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            conn.executescript(f'''
+                CREATE TABLE IF NOT EXISTS slots (
+                    path TEXT PRIMARY KEY,
+                    checked INTEGER NOT NULL,
+                    occupied_by TEXT NOT NULL,
+                    handler TEXT NOT NULL,
+                    use_time INTEGER NOT NULL,
+                    player_time INTEGER NOT NULL,
+                    players INTEGER NOT NULL,
+                    last_mount_ns INTEGER NOT NULL,
+                    config TEXT NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1
+                );
+                CREATE INDEX IF NOT EXISTS slots_checked ON slots(checked, occupied_by);
+                CREATE INDEX IF NOT EXISTS slots_occupied_by ON slots(occupied_by);
+                CREATE INDEX IF NOT EXISTS slots_handler ON slots(handler);
+                CREATE INDEX IF NOT EXISTS slots_use_time ON slots(use_time);
+                CREATE INDEX IF NOT EXISTS slots_player_time ON slots(player_time);
+                CREATE INDEX IF NOT EXISTS slots_players ON slots(players);
+                CREATE INDEX IF NOT EXISTS slots_last_mount ON slots(last_mount_ns);
+                PRAGMA user_version = {SCHEMA_VERSION};
+            ''')
+        debug('Opened slot registry %s', db_file)
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        One connection per thread, autocommit since every write is a single statement
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def key_of(path: str) -> str:
+        return os.path.realpath(path)
+
+    def _import(self, path: str):
+        debug('Importing slot config of %s into the registry', path)
+        self.save(path, self._json.read(path))
+
+    def _row(self, path: str, columns: str) -> Optional[tuple]:
+        row = self._conn().execute(f'SELECT {columns} FROM slots WHERE path = ?', (self.key_of(path),)).fetchone()
+        if row is None and self._json.exists(path):
+            self._import(path)
+            row = self._conn().execute(f'SELECT {columns} FROM slots WHERE path = ?',
+                                       (self.key_of(path),)).fetchone()
+        return row
+
+    def exists(self, path: str) -> bool:
+        try:
+            return self._row(path, 'version') is not None
+        except (OSError, ValueError, sqlite3.Error):
+            return self._json.exists(path)
+
+    def version(self, path: str) -> Optional[tuple]:
+        try:
+            return self._row(path, 'version')
+        except sqlite3.Error as e:
+            # e.g. locked by another instance for too long, the mountable.json is the best we have
+            logger().warning(f'Failed to query slot registry for {path}, reading its mountable config: {e}')
+            return self._json.version(path)
+        except (OSError, ValueError) as e:
+            logger().warning(f'Failed to import slot config in {path}: {e}')
+            return None
+
+    def read(self, path: str) -> SlotConfig:
+        try:
+            row = self._row(path, 'config')
+        except sqlite3.Error as e:
+            logger().warning(f'Failed to query slot registry for {path}, reading its mountable config: {e}')
+            return self._json.read(path)
+        if row is None:
+            raise FileNotFoundError(f'{path} is not in the registry {self.db_file}')
+        return SlotConfig.deserialize(json.loads(row[0]))
+
+    def load(self, path: str) -> SlotConfig:
+        try:
+            return self.read(path)
+        except FileNotFoundError:
+            config = SlotConfig()
+            self.save(path, config)
+            return config
+
+    def save(self, path: str, config: SlotConfig):
+        stats = config.stats
+        self._conn().execute('''
+            INSERT INTO slots (path, checked, occupied_by, handler, use_time, player_time, players, last_mount_ns,
+                               config)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                checked = excluded.checked, occupied_by = excluded.occupied_by, handler = excluded.handler,
+                use_time = excluded.use_time, player_time = excluded.player_time, players = excluded.players,
+                last_mount_ns = excluded.last_mount_ns, config = excluded.config, version = slots.version + 1
+        ''', (self.key_of(path), int(config.checked), config.occupied_by, config.handler, stats.total_use_time,
+              stats.total_player_time, stats.total_players, stats.last_mount_ns,
+              json.dumps(config.serialize(), ensure_ascii=False)))
+
+    def find(self, paths: Iterable[str], checked: Optional[bool] = None, occupied_by: Optional[str] = None,
+             handler: Optional[str] = None) -> List[str]:
+        keys = {i: self.key_of(i) for i in paths}
+        # make sure every given slot is imported, then answer with the indexes, a query for all instead of each
+        try:
+            known = set(i[0] for i in self._conn().execute('SELECT path FROM slots'))
+            for path, key in keys.items():
+                if key not in known and self._json.exists(path):
+                    try:
+                        self._import(path)
+                    except (OSError, ValueError) as e:
+                        logger().warning(f'Failed to import slot config in {path}: {e}')
+        except sqlite3.Error as e:
+            logger().warning(f'Failed to query slot registry, checking the slots one by one: {e}')
+            return super().find(keys, checked, occupied_by, handler)
+        conditions, args = [], []
+        for column, value in (('checked', None if checked is None else int(checked)),
+                              ('occupied_by', occupied_by), ('handler', handler)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                args.append(value)
+        sql = 'SELECT path FROM slots' + (' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else '')
+        try:
+            matched = set(i[0] for i in self._conn().execute(sql, args))
+        except sqlite3.Error as e:
+            logger().warning(f'Failed to query slot registry, checking the slots one by one: {e}')
+            return super().find(keys, checked, occupied_by, handler)
+        return [path for path, key in keys.items() if key in matched]
+
+    def import_json(self, paths: Iterable[str]) -> int:
+        """
+        Overwrite the registry with the mountable.json of the given slots
+        :return: number of slots imported
+        """
+        count = 0
+        for path in paths:
+            if not self._json.exists(path):
+                continue
+            try:
+                self.save(path, self._json.read(path))
+                count += 1
+            except (OSError, ValueError) as e:
+                logger().warning(f'Failed to import slot config in {path}: {e}')
+        return count
+
+    def export_json(self, paths: Iterable[str]) -> int:
+        """
+        Write the registry into the mountable.json of the given slots, e.g. before switching back to json
+        :return: number of slots exported
+        """
+        count = 0
+        for path in paths:
+            row = self._conn().execute('SELECT config FROM slots WHERE path = ?', (self.key_of(path),)).fetchone()
+            if row is None:
+                continue
+            try:
+                self._json.save(path, SlotConfig.deserialize(json.loads(row[0])))
+                count += 1
+            except (OSError, ValueError) as e:
+                logger().warning(f'Failed to export slot config of {path}: {e}')
+        return count
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+_storage: SlotStorage = JsonStorage()
+
+
+def get_storage() -> SlotStorage:
+    return _storage
+
+
+def set_storage(backend: str, db_file: str):
+    """
+    Switch the storage of slot configs, the previous one is closed
+    """
+    global _storage
+    if backend not in REGISTRY_BACKENDS:
+        logger().error(f'Unknown registry backend {backend}, using json')
+        backend = 'json'
+    prev = _storage
+    if backend == 'sqlite':
+        try:
+            _storage = SqliteStorage(db_file)
+        except (OSError, sqlite3.Error) as e:
+            logger().error(f'Failed to open slot registry {db_file}, using json: {e}')
+            _storage = JsonStorage()
+    else:
+        _storage = JsonStorage()
+    prev.close()
@@ -0,0 +1,97 @@
+import os
+import stat
+from typing import Tuple
+
+from .archive_helper import ArchiveHelper
+from .constants import WORLDS
+from .manifest import Manifest, to_path
+from .utils import debug, logger
+
+
+def blob_path(store: str, digest: str) -> str:
+    return os.path.join(store, 'blobs', digest[:2], digest)
+
+
+def freeze(path: str):
+    """
+    Drop the write permission of a blob, shared by all its links
+    """
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & 0o222:
+        os.chmod(path, mode & ~0o222)
+
+
+class StoreHelper:
+    """
+    Content-addressed store shared across slots, template files are replaced with
+    hard links to the blob of their content, so identical files are stored only once.
+
+    Blobs are read-only, a template edited in place, e.g. opened by a server, fails to write
+    instead of silently changing every template linked to the same blob, copy it to edit.
+    The live worlds are still materialized by reflink or copy from the linked templates.
+    A blob with no other link is referenced by no template any more.
+    """
+    @staticmethod
+    def import_template(store: str, template: str) -> Tuple[int, int]:
+        """
+        Import the world files of template into store
+        :return: files imported and bytes deduplicated
+        """
+        if ArchiveHelper.is_archive(template) or not os.path.isdir(template):
+            raise ValueError(f'{template} is not a template dir')
+        logger().info(f'Importing {template} into store {store}...')
+        manifest = Manifest.load(template)
+        manifest.update(WORLDS)
+        imported, saved = 0, 0
+        for rel, (size, _, digest) in manifest.files.items():
+            path = to_path(template, rel)
+            blob = blob_path(store, digest)
+            if not os.path.isfile(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.link(path, blob)
+                imported += 1
+            elif not os.path.samefile(blob, path):
+                tmp = path + '.mount-tmp'
+                os.link(blob, tmp)
+                os.replace(tmp, path)
+                imported += 1
+                saved += size
+            else:
+                # linked already, maybe by a version which left the blob writable
+                freeze(blob)
+                continue
+            freeze(blob)
+            # the linked file takes the mtime of the blob
+            manifest.files[rel] = [size, os.stat(path).st_mtime_ns, digest]
+        manifest.save()
+        logger().info(f'Imported {imported} files into store, {saved} bytes deduplicated')
+        return imported, saved
+
+    @staticmethod
+    def gc(store: str) -> Tuple[int, int]:
+        """
+        Delete blobs which no template links to
+        :return: blobs and bytes removed
+        """
+        removed, freed = 0, 0
+        blob_root = os.path.join(store, 'blobs')
+        if not os.path.isdir(blob_root):
+            return removed, freed
+        for fanout in os.listdir(blob_root):
+            fanout_dir = os.path.join(blob_root, fanout)
+            if not os.path.isdir(fanout_dir):
+                continue
+            for blob in os.listdir(fanout_dir):
+                path = os.path.join(fanout_dir, blob)
+                st = os.stat(path)
+                if st.st_nlink <= 1:
+                    debug('Removing unreferenced blob %s', blob)
+                    # a read-only file can't be removed on windows
+                    os.chmod(path, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+                    os.remove(path)
+                    removed += 1
+                    freed += st.st_size
+            if len(os.listdir(fanout_dir)) == 0:
+                os.rmdir(fanout_dir)
+        logger().info(f'Store gc done, {removed} blobs, {freed} bytes removed')
+        return removed, freed
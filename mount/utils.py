@@ -1,18 +1,136 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
 from mcdreforged.api.types import PluginServerInterface as PSI
 
 psi = PSI.get_instance().as_plugin_server_interface()
 _debug_no_check: bool = False
+# tracing is off unless enabled by setTrace, every trace call returns at the first check then
+_trace_logger: Optional[logging.Logger] = None
+_trace_sample_rate: float = 1.0
 
 def setDebugNoCheck(value: bool):
     logger().info(f'Set debug no check to {value}')
     global _debug_no_check
     _debug_no_check = value
 
+def setTrace(path: Optional[str], sample_rate: float = 1.0, max_mb: int = 10, backup_count: int = 3):
+    """
+    Write trace events as json lines into a rotating file at path, None for disable
+    :param sample_rate: fraction of the events and spans kept
+    """
+    global _trace_logger, _trace_sample_rate
+    _trace_logger = None
+    # the logger outlives plugin reloads, drop the handlers added before
+    trace_logger = logging.getLogger('mount.trace')
+    for handler in list(trace_logger.handlers):
+        trace_logger.removeHandler(handler)
+        handler.close()
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    trace_logger.propagate = False
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.addHandler(RotatingFileHandler(path, maxBytes=max_mb * 1048576, backupCount=backup_count,
+                                                encoding='utf-8'))
+    _trace_sample_rate = sample_rate
+    _trace_logger = trace_logger
+    logger().info(f'Tracing into {path}, sample rate {sample_rate}')
+
 def rtr(translate_key, *args, **kwargs):
     return psi.rtr(f'mount.{translate_key}', *args, **kwargs)
 
 def logger():
     return psi.logger
 
-def debug(msg: str):
-    psi.logger.debug(msg, no_check=_debug_no_check)
\ No newline at end of file
+
+class _LazyMessage:
+    """
+    Formatted only when the logger really emits it
+    """
+    __slots__ = ('msg', 'args')
+
+    def __init__(self, msg: str, args: tuple):
+        self.msg = msg
+        self.args = args
+
+    def __str__(self):
+        return self.msg % self.args
+
+
+def debug(msg: str, *args):
+    """
+    :param msg: message, %-formatted with args only if the debug message is shown
+    """
+    psi.logger.debug(_LazyMessage(msg, args) if len(args) > 0 else msg, no_check=_debug_no_check)
+
+
+def _write_trace(record: dict):
+    trace_logger = _trace_logger
+    if trace_logger is None:
+        return
+    record['thread'] = threading.current_thread().name
+    trace_logger.info(json.dumps(record, default=str, ensure_ascii=False))
+
+def trace(event: str, **fields):
+    """
+    Record a structured event, the fields are serialized only if tracing is enabled and the event is sampled
+    """
+    if _trace_logger is None or (_trace_sample_rate < 1 and random.random() >= _trace_sample_rate):
+        return
+    _write_trace({'ts': time.time(), 'event': event, **fields})
+
+
+class _Span:
+    __slots__ = ('name', 'fields', 'start')
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self.start = 0.0
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        record = {'ts': time.time(), 'span': self.name,
+                  'duration_ms': round((time.perf_counter() - self.start) * 1000, 3), **self.fields}
+        if exc_type is not None:
+            record['error'] = repr(exc_val)
+        _write_trace(record)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name: str, **fields):
+    """
+    Time a block as a span, fields can be added with set() inside the block.
+    A shared no-op span is returned if tracing is disabled or the span is not sampled
+    """
+    if _trace_logger is None or (_trace_sample_rate < 1 and random.random() >= _trace_sample_rate):
+        return _NOOP_SPAN
+    return _Span(name, fields)